@@ -0,0 +1,344 @@
+#!/usr/bin/env python
+"""
+Benchmarks PyDDL on the bundled example problems and on larger generated
+instances of their domains (gripper with more balls, Hanoi with more discs,
+and randomly scrambled 8- and 15-puzzles), with several heuristics and
+search strategies. Each run is made in its own process, and its grounding
+time, heuristic setup time (such as building pattern databases), search
+time, expansions per second, peak memory and plan are written to a JSON
+report. Given a baseline report, runs that got slower, expanded
+more states or found worse plans are listed as regressions.
+
+Example:
+    python benchmark.py -o new.json -b baseline.json -i gripper,hanoi
+"""
+import json
+import multiprocessing
+from queue import Empty
+import platform
+import random
+import sys
+from time import time
+
+from pyddl import (Problem, search, hmax_heuristic, hadd_heuristic,
+                   hff_heuristic, pdb_heuristic)
+import eight_puzzle_example
+import gripper_example
+import hanoi_tower_example
+import missionaries_cannibals_example
+import numeric_effects
+
+# Search configurations: (heuristic factory, keyword arguments for search).
+# The 'example' configuration uses the heuristic an example passes to planner.
+CONFIGS = (
+    ('blind', (None, dict())),
+    ('hmax', (hmax_heuristic, dict())),
+    ('hadd-gbfs', (hadd_heuristic, dict(strategy='gbfs'))),
+    ('hff-gbfs-lazy', (hff_heuristic, dict(strategy='gbfs', lazy=True))),
+    ('hff-wastar', (hff_heuristic, dict(weight=2))),
+    ('pdb', (pdb_heuristic, dict())),
+    ('example', ('example', dict())),
+)
+
+def capture(module, *args):
+    """
+    Runs an example's problem function without solving the problem,
+    returning the Domain and Problem it creates and the heuristic
+    it would pass to the planner
+    """
+    captured = dict()
+    problem_class, planner = module.Problem, module.planner
+
+    def make_problem(domain, *a, **kw):
+        captured['domain'] = domain
+        return problem_class(domain, *a, **kw)
+
+    def capture_planner(problem, heuristic=None, **kwargs):
+        captured['problem'] = problem
+        captured['heuristic'] = heuristic
+        return []
+
+    module.Problem, module.planner = make_problem, capture_planner
+    try:
+        module.problem(False, *args)
+    finally:
+        module.Problem, module.planner = problem_class, planner
+    return captured['domain'], captured['problem'], captured['heuristic']
+
+def example(module, *args):
+    """The problem of an example module (given by name) and its heuristic"""
+    _, problem, heuristic = capture(sys.modules[module], *args)
+    return problem, heuristic
+
+def gripper(balls):
+    """Moving the given number of balls from room A to room B"""
+    domain = capture(gripper_example)[0]
+    names = tuple('ball%d' % i for i in range(1, balls + 1))
+    init = [('ROOM', 'rooma'), ('ROOM', 'roomb'),
+            ('GRIPPER', 'left'), ('GRIPPER', 'right'),
+            ('free', 'left'), ('free', 'right'), ('at-robby', 'rooma')]
+    init += [('BALL', b) for b in names]
+    init += [('at-ball', b, 'rooma') for b in names]
+    goal = [('at-ball', b, 'roomb') for b in names]
+    objects = {
+        'Rooms': ('rooma', 'roomb'),
+        'Balls': names,
+        'Robot-arms': ('left', 'right'),
+    }
+    return Problem(domain, objects, init, goal), None
+
+def hanoi(discs):
+    """Moving a tower of the given number of discs between pegs"""
+    pegs = ('start', 'middle', 'finish')
+    names = tuple('disc%d' % i for i in range(1, discs + 1))
+
+    def tower(peg):
+        return ([('On', a, b) for a, b in zip(names, names[1:])] +
+                [('On', names[-1], peg)])
+
+    init = [('Clear', names[0]), ('Clear', 'middle'), ('Clear', 'finish')]
+    for i, disc in enumerate(names):
+        init += [('smaller', disc, other)
+                 for other in names[i + 1:] + pegs]
+    init += tower('start')
+    goal = [('Clear', 'start'), ('Clear', 'middle'),
+            ('Clear', names[0])] + tower('finish')
+    return Problem(hanoi_tower_example.global_domain,
+                   {'position': pegs + names}, init, goal), None
+
+def sliding_puzzle(size, moves, seed):
+    """
+    A size x size sliding-tile puzzle, scrambled by making the given
+    number of random moves from the goal configuration
+    """
+    domain = capture(eight_puzzle_example)[0]
+    positions = tuple(range(1, size + 1))
+    tiles = tuple(range(1, size*size))
+    static = [('inc', p, p + 1) for p in positions[:-1]]
+    static += [('dec', p + 1, p) for p in positions[:-1]]
+    goal = [('blank', 1, 1)]
+    goal += [('at', t, t % size + 1, t // size + 1) for t in tiles]
+    objects = {'tile': tiles, 'position': positions}
+
+    rng = random.Random(seed)
+    scramble = Problem(domain, objects, static + goal, goal)
+    state = scramble.initial_state
+    for _ in range(moves):
+        action = rng.choice(scramble.applicable_actions(state))
+        state = state.apply(action)
+    return Problem(domain, objects, state.predicates, goal), None
+
+# Instances: (name of a builder above, its arguments). Builders are looked up
+# by name in the benchmark process, so that instances can be sent to it
+# however multiprocessing starts processes.
+INSTANCES = (
+    ('eight-puzzle', ('example', ('eight_puzzle_example',))),
+    ('gripper', ('example', ('gripper_example',))),
+    ('missionaries', ('example', ('missionaries_cannibals_example',))),
+    ('numeric-effects', ('example', ('numeric_effects',))),
+    ('hanoi-3', ('example', ('hanoi_tower_example', 3))),
+    ('hanoi-5', ('example', ('hanoi_tower_example', 5))),
+    ('gripper-8', ('gripper', (8,))),
+    ('gripper-12', ('gripper', (12,))),
+    ('hanoi-6', ('hanoi', (6,))),
+    ('hanoi-7', ('hanoi', (7,))),
+    ('8-puzzle-1', ('sliding_puzzle', (3, 40, 1))),
+    ('8-puzzle-2', ('sliding_puzzle', (3, 40, 2))),
+    ('15-puzzle-1', ('sliding_puzzle', (4, 30, 1))),
+)
+
+# Searches shorter than this many seconds are too noisy to compare speeds
+MIN_TIMED = 0.5
+
+def peak_memory():
+    """Peak resident memory of this process in megabytes (0 if unknown)"""
+    try:
+        import resource
+    except ImportError:
+        return 0
+    usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        return usage / 1048576.0
+    return usage / 1024.0
+
+def run(instance, config, time_limit, results):
+    builder, args = instance
+    factory, kwargs = config
+    problem, example_heuristic = globals()[builder](*args)
+    start = time()
+    if factory == 'example':
+        if example_heuristic is None:
+            # Only some examples come with their own heuristic
+            results.put(None)
+            return
+        heuristic = example_heuristic
+    elif factory is not None:
+        heuristic = factory(problem)
+    else:
+        heuristic = None
+    setup_time = time() - start
+    result = search(problem, heuristic, time_limit=time_limit, **kwargs)
+    stats = result.statistics
+    results.put(dict(
+        status=result.status,
+        plan_length=None if result.plan is None else len(result.plan),
+        plan_cost=None if result.plan is None else result.cost,
+        grounding_time=problem.grounding_time,
+        setup_time=setup_time,
+        search_time=stats.search_time,
+        expanded=stats.expanded,
+        generated=stats.generated,
+        expansions_per_second=stats.expanded / max(stats.search_time, 1e-9),
+        peak_memory=peak_memory(),
+        actions=len(problem.grounded_actions),
+    ))
+
+def benchmark(instances, configs, time_limit, verbose=True):
+    """Runs each configuration on each instance, returning the results"""
+    report = list()
+    for name, instance in instances:
+        for config_name, config in configs:
+            results = multiprocessing.Queue()
+            process = multiprocessing.Process(
+                target=run, args=(instance, config, time_limit, results))
+            process.start()
+            entry = _wait(process, results, 2*time_limit + 60)
+            process.join()
+            if entry is None:
+                continue
+            entry = dict(instance=name, config=config_name, **entry)
+            report.append(entry)
+            if verbose:
+                print(_format(entry))
+                sys.stdout.flush()
+    return report
+
+def _wait(process, results, timeout):
+    """
+    Returns the result of a benchmark process, or a failed entry if the
+    process exits without one or takes more than timeout seconds (allowing
+    for grounding on top of the search time limit), in which case it is
+    terminated
+    """
+    deadline = time() + timeout
+    while time() < deadline:
+        try:
+            return results.get(timeout=0.1)
+        except Empty:
+            pass
+        if process.exitcode is not None:
+            # The result may still be in transit from a process that exited
+            try:
+                return results.get(timeout=1.0)
+            except Empty:
+                return dict(status='failed')
+    process.terminate()
+    return dict(status='failed')
+
+def _format(entry):
+    if 'expanded' not in entry:
+        return '%-16s %-14s %s' % (entry['instance'], entry['config'],
+                                   entry['status'])
+    return ('%-16s %-14s %-11s cost=%-5s expanded=%-8d %9.0f/s '
+            'ground=%.3fs setup=%.3fs search=%.3fs mem=%.0fMB'
+            % (entry['instance'], entry['config'], entry['status'],
+               entry['plan_cost'], entry['expanded'],
+               entry['expansions_per_second'], entry['grounding_time'],
+               entry.get('setup_time', 0.0), entry['search_time'],
+               entry['peak_memory']))
+
+def compare(report, baseline, tolerance):
+    """
+    Returns a list of regressions of the report with respect to a baseline
+    report, allowing a relative slowdown or increase in expansions given by
+    the tolerance
+    """
+    old = dict(((e['instance'], e['config']), e) for e in baseline)
+    regressions = list()
+    for entry in report:
+        key = (entry['instance'], entry['config'])
+        if key not in old:
+            continue
+        before = old[key]
+        if before['status'] == 'solved' and entry['status'] != 'solved':
+            regressions.append((key, 'status', before['status'],
+                                entry['status']))
+            continue
+        if entry['status'] != 'solved' or before['status'] != 'solved':
+            continue
+        if entry['plan_cost'] > before['plan_cost']:
+            regressions.append((key, 'plan_cost', before['plan_cost'],
+                                entry['plan_cost']))
+        if entry['expanded'] > before['expanded']*(1 + tolerance):
+            regressions.append((key, 'expanded', before['expanded'],
+                                entry['expanded']))
+        if (min(entry['search_time'], before['search_time']) >= MIN_TIMED and
+                entry['expansions_per_second'] <
+                before['expansions_per_second']/(1 + tolerance)):
+            regressions.append((key, 'expansions_per_second',
+                                before['expansions_per_second'],
+                                entry['expansions_per_second']))
+        if (entry['grounding_time'] >
+                before['grounding_time']*(1 + tolerance) + 0.01):
+            regressions.append((key, 'grounding_time',
+                                before['grounding_time'],
+                                entry['grounding_time']))
+        if ('setup_time' in before and entry['setup_time'] >
+                before['setup_time']*(1 + tolerance) + 0.01):
+            regressions.append((key, 'setup_time', before['setup_time'],
+                                entry['setup_time']))
+    return regressions
+
+def _select(items, names):
+    if not names:
+        return list(items)
+    names = names.split(',')
+    return [(n, x) for n, x in items if any(s in n for s in names)]
+
+if __name__ == '__main__':
+    from optparse import OptionParser
+    parser = OptionParser(usage="Usage: %prog [options]")
+    parser.add_option('-o', '--output', dest='output',
+                      default='benchmark.json',
+                      help="file to write the JSON report to")
+    parser.add_option('-b', '--baseline', dest='baseline', default=None,
+                      help="JSON report to compare against")
+    parser.add_option('-i', '--instances', dest='instances', default=None,
+                      help="comma-separated parts of instance names to run")
+    parser.add_option('-c', '--configs', dest='configs', default=None,
+                      help="comma-separated parts of configuration names")
+    parser.add_option('-t', '--time-limit', dest='time_limit', type='float',
+                      default=60.0, help="seconds allowed for each search")
+    parser.add_option('--tolerance', dest='tolerance', type='float',
+                      default=0.25,
+                      help="relative slowdown allowed before a regression")
+    parser.add_option('-q', '--quiet',
+                      action='store_false', dest='verbose', default=True,
+                      help="don't print results to stdout")
+
+    # Parse arguments
+    opts, args = parser.parse_args()
+    start = time()
+    results = benchmark(_select(INSTANCES, opts.instances),
+                        _select(CONFIGS, opts.configs),
+                        opts.time_limit, opts.verbose)
+    report = dict(
+        python=platform.python_version(),
+        platform=platform.platform(),
+        time_limit=opts.time_limit,
+        total_time=time() - start,
+        results=results,
+    )
+    with open(opts.output, 'w') as f:
+        json.dump(report, f, indent=2, sort_keys=True)
+
+    if opts.baseline is not None:
+        with open(opts.baseline) as f:
+            baseline = json.load(f)['results']
+        regressions = compare(results, baseline, opts.tolerance)
+        for (instance, config), metric, before, after in regressions:
+            print('REGRESSION %s %s: %s %s -> %s'
+                  % (instance, config, metric, before, after))
+        if regressions:
+            sys.exit(1)
+        print('No regressions against %s' % opts.baseline)
@@ -22,7 +22,6 @@ Goal State:
 | 6   7   8 |
 +---+---+---+
 """
-from __future__ import print_function
 from pyddl import Domain, Problem, Action, neg, planner
 
 def problem(verbose):
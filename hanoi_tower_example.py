@@ -1,4 +1,3 @@
-from __future__ import print_function
 from pyddl import Domain, Problem, Action, planner, neg 
 
 #################################################### 
@@ -1,7 +1,6 @@
 """
 Test support for parametrized increment/decrement values in numeric effects
 """
-from __future__ import print_function
 from pyddl import Domain, Problem, Action, planner
 
 def problem(verbose):
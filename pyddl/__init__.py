@@ -1,2 +1,7 @@
 from .pyddl import *
 from .planner import *
+from .parallel import *
+from .bounded import *
+from .external import *
+from .patterns import *
+from .pddl import *
@@ -0,0 +1,329 @@
+"""
+Search engines using a bounded amount of memory: iterative-deepening A*
+with a transposition table, and simplified memory-bounded A* (SMA*).
+Like search, they return a SearchResult and can be passed to planner
+as its engine.
+"""
+from time import time
+from itertools import count
+import heapq
+
+from .pyddl import State
+from .planner import (null_heuristic, HeuristicCache, SearchResult,
+                      SearchStatistics,
+                      INFINITY, SOLVED, UNSOLVABLE, EXPANSION_LIMIT,
+                      TIME_LIMIT)
+
+__all__ = ['ida_search', 'sma_search']
+
+def ida_search(problem, heuristic=None, state0=None, goal=None,
+               monotone=False, table_size=1000000, max_expansions=None,
+               time_limit=None):
+    """
+    Iterative-deepening A* (IDA*): repeated depth-first searches that
+    prune states with g + h above a threshold, which starts at h of the
+    initial state and is raised to the smallest pruned value after each
+    iteration. Memory use is linear in the plan length, plus a
+    transposition table caching heuristic values and pruning states
+    already reached as cheaply in the current iteration. With an
+    admissible heuristic, the plan found has minimum cost.
+    Arguments (see planner for the first five):
+    table_size - maximum number of states in the transposition table
+                 (0 to disable it)
+    max_expansions - maximum number of states to expand
+    time_limit - maximum number of seconds to search
+    """
+    heuristic, state0, goal_mask, num_goals = _prepare(problem, heuristic,
+                                                       state0, goal)
+    if max_expansions is None:
+        max_expansions = INFINITY
+    stats = SearchStatistics(getattr(problem, 'grounding_time', 0.0))
+    start = time()
+
+    def evaluate(state):
+        t = time()
+        h = heuristic(state)
+        stats.heuristic_time += time() - t
+        stats.evaluations += 1
+        return h
+
+    def stop(status, path=None):
+        stats.search_time = time() - start
+        if path is None:
+            return SearchResult(status, state0, stats)
+        plan = [frame[4] for frame in path[1:]]
+        return SearchResult(status, state0, stats, plan, path[-1][0])
+
+    # Transposition table entries are [g, iteration, h]
+    table = dict()
+    h0 = evaluate(state0)
+    threshold = h0
+    iteration = 0
+    while threshold < INFINITY:
+        iteration += 1
+        next_threshold = INFINITY
+        # Frames are [state, g, children, next child, action]
+        path = [[state0, 0, None, 0, None]]
+        on_path = set([state0])
+        while path:
+            frame = path[-1]
+            state, g, children = frame[0], frame[1], frame[2]
+            if children is None:
+                if state.holds(goal_mask, num_goals):
+                    return stop(SOLVED, path)
+                if stats.expanded >= max_expansions:
+                    return stop(EXPANSION_LIMIT)
+                if time_limit is not None and time() - start > time_limit:
+                    return stop(TIME_LIMIT)
+                stats.expanded += 1
+
+                # Order successors by their heuristic value
+                t = time()
+                children = list()
+                for action in problem.applicable_actions(state):
+                    successor = state.apply(action, monotone)
+                    children.append((successor, action))
+                stats.successor_time += time() - t
+                stats.generated += len(children)
+                evaluated = list()
+                for successor, action in children:
+                    entry = table.get(successor)
+                    h = evaluate(successor) if entry is None else entry[2]
+                    evaluated.append((h, successor, action))
+                evaluated.sort(key=lambda c: c[0])
+                frame[2] = children = evaluated
+
+            if frame[3] == len(children):
+                on_path.discard(state)
+                path.pop()
+                continue
+            h, successor, action = children[frame[3]]
+            frame[3] += 1
+            cost = g + successor.cost - state.cost
+            if cost + h > threshold:
+                next_threshold = min(next_threshold, cost + h)
+                continue
+            if successor in on_path:
+                stats.duplicates += 1
+                continue
+            entry = table.get(successor)
+            if entry is not None:
+                if entry[1] == iteration and entry[0] <= cost:
+                    stats.duplicates += 1
+                    continue
+                entry[0], entry[1] = cost, iteration
+            elif len(table) < table_size:
+                table[successor] = [cost, iteration, h]
+            # Predecessor chains are not needed along the path
+            successor.predecessor = None
+            path.append([successor, cost, None, 0, action])
+            on_path.add(successor)
+            stats.peak_open = max(stats.peak_open, len(path))
+            stats.peak_closed = len(table)
+        threshold = next_threshold
+    return stop(UNSOLVABLE)
+
+class _Node(object):
+    __slots__ = ('state', 'g', 'f', 'depth', 'parent', 'action', 'children',
+                 'forgotten', 'version')
+
+    def __init__(self, state, g, f, depth, parent, action):
+        self.state = state
+        self.g = g
+        self.f = f
+        self.depth = depth
+        self.parent = parent
+        self.action = action
+        # Children in memory, or None for a leaf
+        self.children = None
+        # Lowest f of children removed from memory
+        self.forgotten = INFINITY
+        # Incremented to invalidate queue entries for this node
+        self.version = 0
+
+def sma_search(problem, heuristic=None, state0=None, goal=None,
+               monotone=False, max_nodes=100000, max_expansions=None,
+               time_limit=None):
+    """
+    Simplified memory-bounded A* (SMA*): A* over a search tree of at most
+    max_nodes nodes. When memory is full, the leaf with the highest f
+    (the shallowest among ties) is removed and its f value is backed up
+    into its parent, which is expanded again if it becomes the best leaf.
+    Successors whose state is already in the tree at no greater cost are
+    not added, and the heuristic values of the last max_nodes states
+    evaluated are cached, as removed nodes are often generated again.
+    With an admissible heuristic, this finds a minimum-cost plan if one
+    needs fewer than max_nodes steps.
+    Arguments (see planner for the first five):
+    max_nodes - maximum number of search nodes kept in memory
+    max_expansions - maximum number of states to expand
+    time_limit - maximum number of seconds to search
+    """
+    heuristic, state0, goal_mask, num_goals = _prepare(problem, heuristic,
+                                                       state0, goal)
+    if max_expansions is None:
+        max_expansions = INFINITY
+    max_nodes = max(max_nodes, 2)
+    stats = SearchStatistics(getattr(problem, 'grounding_time', 0.0))
+    start = time()
+    cache = HeuristicCache(heuristic, max_nodes)
+
+    def evaluate(state):
+        t = time()
+        h = cache(state)
+        stats.heuristic_time += time() - t
+        stats.evaluations += 1
+        return h
+
+    def stop(status, node=None):
+        stats.search_time = time() - start
+        if node is None:
+            return SearchResult(status, state0, stats)
+        plan = list()
+        n = node
+        while n.parent is not None:
+            plan.append(n.action)
+            n = n.parent
+        plan.reverse()
+        return SearchResult(status, state0, stats, plan, node.state)
+
+    # Leaves are queued by (f, -depth) for expansion and by (-f, depth)
+    # for removal; entries whose version is out of date are skipped, and
+    # dropped by compact once there are too many of them
+    counter = count()
+    best = list()
+    worst = list()
+    leaves = [0]
+
+    def live(entry):
+        node = entry[-1]
+        return entry[2] == node.version and node.children is None
+
+    def push(node):
+        node.version += 1
+        entry = (node.version, next(counter), node)
+        heapq.heappush(best, (node.f, -node.depth) + entry)
+        heapq.heappush(worst, (-node.f, node.depth) + entry)
+        leaves[0] += 1
+
+    def pop(queue):
+        while queue:
+            entry = heapq.heappop(queue)
+            if live(entry):
+                leaves[0] -= 1
+                return entry[-1]
+        return None
+
+    def compact():
+        for queue in (best, worst):
+            queue[:] = [entry for entry in queue if live(entry)]
+            heapq.heapify(queue)
+
+    # Nodes in the tree by state
+    in_tree = dict()
+
+    def backup(node):
+        # Propagates increased f values of expanded nodes to the root
+        while node is not None and node.children is not None:
+            f = min([c.f for c in node.children] + [node.forgotten])
+            if f == node.f:
+                break
+            node.f = f
+            node = node.parent
+
+    root = _Node(state0, 0, evaluate(state0), 0, None, None)
+    push(root)
+    in_tree[state0] = root
+    n_nodes = 1
+    while True:
+        node = pop(best)
+        if node is None or node.f == INFINITY:
+            return stop(UNSOLVABLE)
+        if node.state.holds(goal_mask, num_goals):
+            return stop(SOLVED, node)
+        if stats.expanded >= max_expansions:
+            return stop(EXPANSION_LIMIT)
+        if time_limit is not None and time() - start > time_limit:
+            return stop(TIME_LIMIT)
+        stats.expanded += 1
+
+        # Generate all successors, except those repeating a state on the
+        # path; nodes at the depth limit can never reach a goal in memory
+        ancestors = set()
+        n = node
+        while n is not None:
+            ancestors.add(n.state)
+            n = n.parent
+        t = time()
+        successors = [(node.state.apply(action, monotone), action)
+                      for action in problem.applicable_actions(node.state)]
+        stats.successor_time += time() - t
+        stats.generated += len(successors)
+        children = list()
+        for successor, action in successors:
+            if successor in ancestors:
+                stats.duplicates += 1
+                continue
+            g = node.g + successor.cost - node.state.cost
+            other = in_tree.get(successor)
+            if other is not None and other.g <= g:
+                stats.duplicates += 1
+                continue
+            successor.predecessor = None
+            if (node.depth + 2 >= max_nodes and
+                    not successor.holds(goal_mask, num_goals)):
+                f = INFINITY
+            else:
+                f = max(node.f, g + evaluate(successor))
+            children.append(_Node(successor, g, f, node.depth + 1, node,
+                                  action))
+        node.version += 1
+        node.children = children
+        node.forgotten = INFINITY
+        if not children:
+            node.children = None
+            node.f = INFINITY
+            push(node)
+        for child in children:
+            push(child)
+            in_tree[child.state] = child
+        n_nodes += len(children)
+        backup(node)
+
+        # Remove the worst leaves until the tree fits in memory
+        while n_nodes > max_nodes:
+            leaf = pop(worst)
+            if leaf is None or leaf.parent is None:
+                break
+            leaf.version += 1
+            if in_tree.get(leaf.state) is leaf:
+                del in_tree[leaf.state]
+            parent = leaf.parent
+            parent.children.remove(leaf)
+            parent.forgotten = min(parent.forgotten, leaf.f)
+            n_nodes -= 1
+            if not parent.children:
+                parent.children = None
+                parent.f = parent.forgotten
+                push(parent)
+        if len(best) + len(worst) > 4*max_nodes:
+            compact()
+        stats.peak_open = max(stats.peak_open, leaves[0])
+        stats.peak_closed = max(stats.peak_closed, n_nodes)
+
+def _prepare(problem, heuristic, state0, goal):
+    """
+    Returns the heuristic, initial state, goal bitset and numeric goals
+    for a search, with the defaults used by search
+    """
+    if heuristic is None:
+        heuristic = null_heuristic
+    if state0 is None:
+        state0 = problem.initial_state
+    if goal is None:
+        goal = (problem.goals, problem.num_goals)
+    if (state0.atoms is not problem.atoms or
+            state0.fluents is not problem.fluents):
+        state0 = State(state0.predicates, state0.f_dict,
+                       atoms=problem.atoms, fluents=problem.fluents)
+    return heuristic, state0, problem.atoms.mask(goal[0]), goal[1]
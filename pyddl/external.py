@@ -0,0 +1,425 @@
+"""
+External-memory A* search, keeping its open and closed lists in files
+rather than in memory
+"""
+from time import time
+import heapq
+import mmap
+import os
+import shutil
+import struct
+import tempfile
+
+from .planner import (SearchResult, SearchStatistics,
+                      INFINITY, SOLVED, UNSOLVABLE, EXPANSION_LIMIT,
+                      TIME_LIMIT)
+from .bounded import _prepare
+
+__all__ = ['external_search', 'PARTITION_SIZE']
+
+# Number of states kept in memory at once for duplicate detection
+PARTITION_SIZE = 1 << 20
+
+def external_search(problem, heuristic=None, state0=None, goal=None,
+                    monotone=False, directory=None,
+                    partition_size=PARTITION_SIZE, max_expansions=None,
+                    time_limit=None):
+    """
+    A* search whose states are stored on disk as fixed-size records, so
+    that it is limited by disk space rather than memory. Generated states
+    are appended to open files bucketed by f-value, without checking for
+    duplicates. The lowest bucket is then processed one layer at a time:
+    the layer is split by hash into partitions of at most partition_size
+    states, which are deduplicated in memory and against a closed hash
+    table held in a memory-mapped file (delayed duplicate detection), and
+    the remaining states are expanded. With an admissible heuristic, the
+    plan found has minimum cost. Returns a SearchResult.
+    Arguments (see planner for the first five):
+    directory - directory in which to create the search files (a system
+                temporary directory by default); they are removed when
+                the search returns
+    partition_size - maximum number of states deduplicated in memory
+    max_expansions - maximum number of states to expand
+    time_limit - maximum number of seconds to search
+    """
+    heuristic, state0, goal_mask, num_goals = _prepare(problem, heuristic,
+                                                       state0, goal)
+    if max_expansions is None:
+        max_expansions = INFINITY
+    stats = SearchStatistics(getattr(problem, 'grounding_time', 0.0))
+    start = time()
+    directory = tempfile.mkdtemp(prefix='pyddl-', dir=directory)
+    codec = _RecordCodec(problem)
+    actions = problem.grounded_actions
+    action_index = problem.action_index
+    log = _RecordLog(os.path.join(directory, 'closed.log'), codec.size)
+    closed = _DiskHashTable(os.path.join(directory, 'closed.table'))
+    buckets = _Buckets(directory, codec.size)
+
+    def evaluate(state):
+        t = time()
+        h = heuristic(state)
+        stats.heuristic_time += time() - t
+        stats.evaluations += 1
+        return h
+
+    def stop(status, index=None):
+        stats.search_time = time() - start
+        if index is None:
+            return SearchResult(status, state0, stats)
+        # Follow parent records back from the goal, then replay the plan
+        indices = list()
+        while True:
+            parent, action = codec.parent(log.read(index))
+            if parent < 0:
+                break
+            indices.append(action)
+            index = parent
+        state = state0
+        plan = list()
+        for i in reversed(indices):
+            state = state.apply(actions[i], monotone)
+            plan.append(actions[i])
+        return SearchResult(status, state0, stats, plan, state)
+
+    def partitions(layer, n):
+        # Splits a layer into partitions that fit in memory by hash
+        if n <= partition_size:
+            yield layer.records()
+            return
+        parts = n // partition_size + 1
+        writers = [_RecordFile('%s.%d' % (layer.path, i), codec.size)
+                   for i in range(parts)]
+        for record in layer.records():
+            writers[codec.hash(record) % parts].append(record)
+        for writer in writers:
+            writer.close()
+            yield writer.records()
+            writer.remove()
+
+    try:
+        h0 = evaluate(state0)
+        if h0 == INFINITY:
+            return stop(UNSOLVABLE)
+        buckets.add(h0, codec.encode(state0, -1, -1))
+        while buckets:
+            f = buckets.lowest()
+            while True:
+                layer, n = buckets.take(f)
+                if layer is None:
+                    break
+                for part in partitions(layer, n):
+                    # Keep the cheapest copy of each state in the partition
+                    best = dict()
+                    for record in part:
+                        state_bytes = codec.state_bytes(record)
+                        other = best.get(state_bytes)
+                        if other is None:
+                            best[state_bytes] = record
+                        else:
+                            stats.duplicates += 1
+                            if codec.cost(record) < codec.cost(other):
+                                best[state_bytes] = record
+
+                    for state_bytes, record in best.items():
+                        key = codec.hash(record)
+                        cost = codec.cost(record)
+                        slot, index = closed.find(key, state_bytes, log, codec)
+                        if index is not None:
+                            if codec.cost(log.read(index)) <= cost:
+                                stats.duplicates += 1
+                                continue
+                        index = log.append(record)
+                        closed.put(slot, key, index)
+                        stats.peak_closed = max(stats.peak_closed, len(log))
+
+                        state = codec.decode(record)
+                        if state.holds(goal_mask, num_goals):
+                            return stop(SOLVED, index)
+                        if stats.expanded >= max_expansions:
+                            return stop(EXPANSION_LIMIT)
+                        if (time_limit is not None and
+                                time() - start > time_limit):
+                            return stop(TIME_LIMIT)
+                        stats.expanded += 1
+
+                        t = time()
+                        successors = [(state.apply(a, monotone), a) for a in
+                                      problem.applicable_actions(state)]
+                        stats.successor_time += time() - t
+                        stats.generated += len(successors)
+                        for successor, action in successors:
+                            h = evaluate(successor)
+                            if h == INFINITY:
+                                continue
+                            g = successor.cost - state0.cost
+                            buckets.add(max(f, g + h), codec.encode(
+                                successor, index, action_index[action]))
+                        stats.peak_open = max(stats.peak_open, len(buckets))
+                layer.remove()
+        return stop(UNSOLVABLE)
+    finally:
+        buckets.close()
+        closed.close()
+        log.close()
+        shutil.rmtree(directory, ignore_errors=True)
+
+class _RecordCodec(object):
+    """
+    Converts states to fixed-size records: the state's bitset, its
+    function values (8 bytes each, with a type byte for None, int or
+    float), its hash and cost, and the indices of its parent record and
+    of the action applied to the parent
+    """
+
+    def __init__(self, problem):
+        self.problem = problem
+        self.n_bytes = len(problem.atoms.atoms) // 8 + 1
+        self.n_values = len(problem.fluents.atoms)
+        self.values = struct.Struct('<%dq' % self.n_values)
+        self.header = struct.Struct('<Qdqi')
+        self.state_size = self.n_bytes + 9*self.n_values
+        self.size = self.state_size + self.header.size
+
+    def encode(self, state, parent, action):
+        n = self.n_values
+        types = bytearray(n)
+        raw = [0]*n
+        for i, v in enumerate(state.values):
+            if v is None:
+                continue
+            if isinstance(v, int):
+                types[i] = 1
+                raw[i] = v
+            else:
+                types[i] = 2
+                raw[i] = struct.unpack('<q', struct.pack('<d', v))[0]
+        return (_to_bytes(state.bits, self.n_bytes) + bytes(types) +
+                self.values.pack(*raw) +
+                self.header.pack(hash(state) & 0xffffffffffffffff,
+                                 state.cost, parent, action))
+
+    def decode(self, record):
+        n_bytes, n = self.n_bytes, self.n_values
+        bits = _from_bytes(record[:n_bytes])
+        values = list()
+        if n:
+            types = bytearray(record[n_bytes:n_bytes + n])
+            raw = self.values.unpack_from(record, n_bytes + n)
+            for t, v in zip(types, raw):
+                if t == 0:
+                    values.append(None)
+                elif t == 1:
+                    values.append(v)
+                else:
+                    values.append(struct.unpack('<d', struct.pack('<q', v))[0])
+        return self.problem.make_state(bits, tuple(values), self.cost(record))
+
+    def state_bytes(self, record):
+        return record[:self.state_size]
+
+    def hash(self, record):
+        """64-bit hash of the state in a record"""
+        return self.header.unpack_from(record, self.state_size)[0]
+
+    def cost(self, record):
+        return self.header.unpack_from(record, self.state_size)[1]
+
+    def parent(self, record):
+        """Returns the indices of the parent record and of the action"""
+        return self.header.unpack_from(record, self.state_size)[2:]
+
+def _to_bytes(bits, n):
+    return bits.to_bytes(n, 'little')
+
+def _from_bytes(data):
+    return int.from_bytes(data, 'little')
+
+class _RecordFile(object):
+    """An append-only file of fixed-size records"""
+
+    def __init__(self, path, size):
+        self.path = path
+        self.size = size
+        self.count = 0
+        self.file = open(path, 'wb')
+
+    def append(self, record):
+        self.file.write(record)
+        self.count += 1
+
+    def close(self):
+        if not self.file.closed:
+            self.file.close()
+
+    def records(self):
+        """Yields the records of the closed file"""
+        size = self.size
+        with open(self.path, 'rb') as f:
+            while True:
+                chunk = f.read(size*4096)
+                if not chunk:
+                    return
+                for i in range(0, len(chunk), size):
+                    yield chunk[i:i + size]
+
+    def remove(self):
+        self.close()
+        os.remove(self.path)
+
+class _Buckets(object):
+    """Open list: one record file per f-value"""
+
+    def __init__(self, directory, size):
+        self.directory = directory
+        self.size = size
+        self.files = dict()
+        self.heap = list()
+        self.queued = set()
+        self.count = 0
+        self.layers = 0
+
+    def add(self, f, record):
+        bucket = self.files.get(f)
+        if bucket is None:
+            path = os.path.join(self.directory, 'open.%d' % self.layers)
+            self.layers += 1
+            bucket = self.files[f] = _RecordFile(path, self.size)
+            if f not in self.queued:
+                self.queued.add(f)
+                heapq.heappush(self.heap, f)
+        bucket.append(record)
+        self.count += 1
+
+    def lowest(self):
+        return self.heap[0]
+
+    def take(self, f):
+        """
+        Returns the file of records added to bucket f since the last call
+        and their number, or (None, 0) once the bucket is empty
+        """
+        bucket = self.files.pop(f, None)
+        if bucket is None:
+            self.queued.discard(f)
+            heapq.heappop(self.heap)
+            return None, 0
+        bucket.close()
+        self.count -= bucket.count
+        return bucket, bucket.count
+
+    def close(self):
+        for bucket in self.files.values():
+            bucket.close()
+
+    def __len__(self):
+        return self.count
+
+    def __bool__(self):
+        return bool(self.heap)
+
+class _RecordLog(object):
+    """
+    Closed states in the order they were expanded, read back through
+    a memory map that is extended as the file grows
+    """
+
+    def __init__(self, path, size):
+        self.size = size
+        self.count = 0
+        self.file = open(path, 'w+b')
+        self.map = None
+        self.mapped = 0
+
+    def append(self, record):
+        self.file.write(record)
+        self.count += 1
+        return self.count - 1
+
+    def read(self, index):
+        if index >= self.mapped:
+            self.file.flush()
+            if self.map is not None:
+                self.map.close()
+            self.map = mmap.mmap(self.file.fileno(), 0,
+                                 access=mmap.ACCESS_READ)
+            self.mapped = self.count
+        start = index*self.size
+        return self.map[start:start + self.size]
+
+    def close(self):
+        if self.map is not None:
+            self.map.close()
+        self.file.close()
+
+    def __len__(self):
+        return self.count
+
+class _DiskHashTable(object):
+    """
+    Open-addressing hash table in a memory-mapped file, mapping state
+    hashes to the indices of their records in a _RecordLog. Each slot
+    holds a 64-bit hash and the record index plus one (0 for an empty
+    slot); the table doubles in size when it is half full.
+    """
+    SLOT = struct.Struct('<Qq')
+
+    def __init__(self, path, slots=1 << 16):
+        self.path = path
+        self.count = 0
+        self._open(slots)
+
+    def _open(self, slots):
+        self.slots = slots
+        with open(self.path, 'wb') as f:
+            f.truncate(slots*self.SLOT.size)
+        self.file = open(self.path, 'r+b')
+        self.map = mmap.mmap(self.file.fileno(), 0)
+
+    def find(self, key, state_bytes, log, codec):
+        """
+        Returns (slot, record index) for a state, with a record index of
+        None and the free slot to insert it at if it is not in the table
+        """
+        SLOT, mask = self.SLOT, self.slots - 1
+        slot = key & mask
+        while True:
+            k, index = SLOT.unpack_from(self.map, slot*SLOT.size)
+            if index == 0:
+                return slot, None
+            if (k == key and
+                    codec.state_bytes(log.read(index - 1)) == state_bytes):
+                return slot, index - 1
+            slot = (slot + 1) & mask
+
+    def put(self, slot, key, index):
+        """Stores a record index at a slot returned by find"""
+        SLOT = self.SLOT
+        if SLOT.unpack_from(self.map, slot*SLOT.size)[1] == 0:
+            self.count += 1
+        SLOT.pack_into(self.map, slot*SLOT.size, key, index + 1)
+        if 2*self.count > self.slots:
+            self._grow()
+
+    def _grow(self):
+        SLOT = self.SLOT
+        old_file, old_map, old_slots = self.file, self.map, self.slots
+        os.rename(self.path, self.path + '.old')
+        self._open(2*old_slots)
+        mask = self.slots - 1
+        for start in range(0, old_slots*SLOT.size, SLOT.size):
+            key, index = SLOT.unpack_from(old_map, start)
+            if index == 0:
+                continue
+            slot = key & mask
+            while SLOT.unpack_from(self.map, slot*SLOT.size)[1] != 0:
+                slot = (slot + 1) & mask
+            SLOT.pack_into(self.map, slot*SLOT.size, key, index)
+        old_map.close()
+        old_file.close()
+        os.remove(self.path + '.old')
+
+    def close(self):
+        if not self.file.closed:
+            self.map.close()
+            self.file.close()
@@ -0,0 +1,194 @@
+"""
+Numeric conditions and effects, compiled to slots of interned
+function symbols so they can be evaluated without dictionary lookups.
+When NumPy is available, the numeric preconditions of many actions
+are checked together with array operations.
+"""
+import operator as ops
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+__all__ = ['NUM_OPS', 'NumericCondition', 'NumericEffect', 'NumericTable']
+
+NUM_OPS = {
+    '>' : ops.gt,
+    '<' : ops.lt,
+    '=' : ops.eq,
+    '>=': ops.ge,
+    '<=': ops.le
+}
+
+# Minimum number of numeric preconditions for which
+# NumericTable uses NumPy (when it is installed)
+VECTORIZE_THRESHOLD = 32
+
+def _operand(fluents, x):
+    """
+    Compiles an operand to a (slot, constant) pair, where slot is None
+    if the operand is a constant rather than a function symbol
+    """
+    if isinstance(x, tuple):
+        return fluents.intern(x), None
+    return None, x
+
+class NumericCondition(object):
+
+    def __init__(self, op, lhs, rhs):
+        """
+        A numerical comparison that is called on a State
+        @arg op : comparison operator (a key of NUM_OPS)
+        @arg lhs : number or (ground) function symbol
+        @arg rhs : number or (ground) function symbol
+        """
+        self.op = op
+        self.lhs = lhs
+        self.rhs = rhs
+        self._fluents = None
+        self._compiled = None
+
+    def compiled(self, fluents):
+        """
+        Returns (comparison, lhs slot, lhs constant, rhs slot, rhs constant)
+        for the given table of function symbols, caching the result
+        """
+        if self._fluents is not fluents:
+            self._compiled = ((NUM_OPS[self.op],) + _operand(fluents, self.lhs)
+                              + _operand(fluents, self.rhs))
+            self._fluents = fluents
+        return self._compiled
+
+    def __call__(self, state):
+        op, ls, lc, rs, rc = self.compiled(state.fluents)
+        values = state.values
+        return op(lc if ls is None else values[ls],
+                  rc if rs is None else values[rs])
+
+    def __getstate__(self):
+        return (self.op, self.lhs, self.rhs)
+
+    def __setstate__(self, state):
+        self.__init__(*state)
+
+    def __str__(self):
+        return '(%s %s %s)' % (self.op, self.lhs, self.rhs)
+
+class NumericEffect(object):
+
+    def __init__(self, function, sign, value):
+        """
+        Increases (sign=1) or decreases (sign=-1) a function
+        @arg function : (ground) function symbol to change
+        @arg sign : 1 for '+=' or -1 for '-='
+        @arg value : number or (ground) function symbol
+        """
+        self.function = function
+        self.sign = sign
+        self.value = value
+
+    def compiled(self, fluents):
+        """Returns (target slot, sign, value slot, value constant)"""
+        return ((fluents.intern(self.function), self.sign)
+                + _operand(fluents, self.value))
+
+    def __str__(self):
+        return '(%s %s %s)' % ('+=' if self.sign > 0 else '-=',
+                               self.function, self.value)
+
+class NumericTable(object):
+
+    def __init__(self, actions, fluents):
+        """
+        Compiles the numeric preconditions of grounded actions into index
+        and constant arrays, so that the preconditions of all candidate
+        actions can be checked for a state at once
+        @arg actions : list of grounded actions
+        @arg fluents : AtomTable of function symbols used to encode states
+        """
+        self.fluents = fluents
+        self.index = dict()
+        self.conditions = list()
+        owners = list()
+        compiled = list()
+        for i, action in enumerate(actions):
+            self.index[action] = i
+            conditions = [c.compiled(fluents) for c in action.num_preconditions]
+            self.conditions.append(conditions)
+            owners.extend([i]*len(conditions))
+            compiled.extend(conditions)
+        self.n_conditions = len(compiled)
+
+        self.n_actions = len(actions)
+        self.vectorized = (np is not None and
+                           self.n_conditions >= VECTORIZE_THRESHOLD)
+        if np is not None and self.n_conditions > 0:
+            self.sides = list()
+            for k in (1, 3):
+                slots = [c[k] for c in compiled]
+                constants = [c[k + 1] for c in compiled]
+                is_slot = np.array([s is not None for s in slots])
+                self.sides.append((is_slot,
+                                   np.array([s or 0 for s in slots], dtype=int),
+                                   np.array([0 if c is None else c
+                                             for c in constants], dtype=float)))
+            self.groups = list()
+            for op in set(c[0] for c in compiled):
+                members = np.array([j for j, c in enumerate(compiled)
+                                    if c[0] is op], dtype=int)
+                self.groups.append((op, members))
+            # Conditions are stored in action order, so each constrained
+            # action's conditions are reduced from its first one
+            self.constrained = np.array([i for i, c in
+                                         enumerate(self.conditions) if c],
+                                        dtype=int)
+            self.starts = np.array([j for j in range(len(owners))
+                                    if j == 0 or owners[j] != owners[j - 1]],
+                                   dtype=int)
+
+    def filter(self, state, actions):
+        """
+        Returns the given actions whose numerical preconditions
+        hold in the state
+        """
+        if self.n_conditions == 0:
+            return actions
+        if self.vectorized:
+            failed = self.failed([state.values])[0]
+            index = self.index
+            return [a for a in actions if not failed[index[a]]]
+
+        values = state.values
+        applicable = list()
+        for action in actions:
+            for op, ls, lc, rs, rc in self.conditions[self.index[action]]:
+                if not op(lc if ls is None else values[ls],
+                          rc if rs is None else values[rs]):
+                    break
+            else:
+                applicable.append(action)
+        return applicable
+
+    def failed(self, values):
+        """
+        Returns a boolean array with a row for each of the given tuples of
+        function values (one per state), indicating for every action
+        whether any of its numerical preconditions fails (requires NumPy)
+        """
+        k = len(values)
+        failed = np.zeros((k, self.n_actions), dtype=bool)
+        if self.n_conditions == 0:
+            return failed
+        v = np.array([[np.nan if x is None else x for x in row]
+                      for row in values], dtype=float).reshape(k, -1)
+        operands = list()
+        for is_slot, slots, constants in self.sides:
+            operands.append(np.where(is_slot, v[:, slots], constants))
+        lhs, rhs = operands
+        holds = np.empty((k, self.n_conditions), dtype=bool)
+        for op, members in self.groups:
+            holds[:, members] = op(lhs[:, members], rhs[:, members])
+        failed[:, self.constrained] = ~np.logical_and.reduceat(
+            holds, self.starts, axis=1)
+        return failed
@@ -0,0 +1,432 @@
+"""
+Search engines that use several processes for a single problem
+"""
+from time import time
+from itertools import count
+import heapq
+import multiprocessing
+from queue import Empty
+
+from .planner import (search, null_heuristic, SearchResult, SearchStatistics,
+                      INFINITY, SOLVED, UNSOLVABLE, TIME_LIMIT)
+
+__all__ = ['hda_planner', 'hda_search', 'portfolio_planner',
+           'portfolio_search', 'FAILED']
+
+# Status of a portfolio configuration whose search raised an exception
+FAILED = 'failed'
+
+def hda_planner(problem, heuristic=None, workers=None, verbose=True,
+                **kwargs):
+    """
+    Hash-distributed A* (HDA*): like planner, but the search is spread
+    over several worker processes. See hda_search for the arguments.
+    """
+    result = hda_search(problem, heuristic, workers, **kwargs)
+    if verbose:
+        print('States Explored: %d' % result.expanded)
+        if result.plan is not None:
+            print('Plan length: %d' % len(result.plan))
+            print('Plan cost: %g' % result.cost)
+        elif result.status != SOLVED:
+            print('Search stopped: %s' % result.status)
+    return result.plan
+
+def hda_search(problem, heuristic=None, workers=None, time_limit=None,
+               exchange_interval=32):
+    """
+    Hash-distributed A* search, returning a SearchResult. Each state is
+    owned by the worker process given by its Zobrist hash, which keeps its
+    own open and closed lists; generated states are sent to their owners.
+    The search ends once a plan is known and every worker is idle (with no
+    node cheaper than the plan) while no states are in transit, so with an
+    admissible heuristic the plan is optimal. Raises RuntimeError if a
+    worker process fails.
+    Arguments:
+    problem   - a pyddl Problem
+    heuristic - a picklable function returning a heuristic for the problem,
+                such as hmax_heuristic (h(state) = 0 by default); each
+                worker calls it once to build its own heuristic
+    workers   - number of worker processes (one per CPU by default)
+    time_limit - maximum number of seconds to search
+    exchange_interval - number of expansions between sends of generated
+                        states to other workers
+    """
+    if workers is None:
+        workers = multiprocessing.cpu_count()
+    start = time()
+    results = multiprocessing.Queue()
+    inboxes = [multiprocessing.Queue() for _ in range(workers)]
+    processes = [multiprocessing.Process(
+                    target=_hda_worker,
+                    args=(problem, heuristic, i, inboxes, results,
+                          exchange_interval))
+                 for i in range(workers)]
+    for process in processes:
+        process.daemon = True
+        process.start()
+
+    try:
+        return _hda_run(problem, processes, inboxes, results, start,
+                        time_limit)
+    finally:
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+        for process in processes:
+            process.join()
+
+def _hda_run(problem, processes, inboxes, results, start, time_limit):
+    """Coordinates the HDA* workers, returning a SearchResult"""
+    workers = len(processes)
+    deadline = None if time_limit is None else start + time_limit
+    state0 = problem.initial_state
+    key0 = (state0.bits, state0.values)
+    inboxes[_owner(problem, key0, workers, state0.key)].put(
+        ('states', [(key0, state0.cost, None, None)]))
+    sent = 1
+
+    best_cost = INFINITY
+    best_key = None
+    best_owner = None
+    status = None
+    previous = None
+    wave = 0
+    while status is None:
+        if deadline is not None and time() > deadline:
+            status = TIME_LIMIT
+            break
+
+        # Probe all workers; termination requires two consecutive waves
+        # in which all are idle with equal, unchanged message counts
+        wave += 1
+        for inbox in inboxes:
+            inbox.put(('probe', wave))
+        replies = list()
+        while len(replies) < workers:
+            message = _receive(results, processes, deadline)
+            if message is None:
+                status = TIME_LIMIT
+                break
+            if message[0] == 'solution':
+                _, cost, key, owner = message
+                if cost < best_cost:
+                    best_cost, best_key, best_owner = cost, key, owner
+                    for inbox in inboxes:
+                        inbox.put(('bound', best_cost))
+            elif message[0] == 'probe' and message[1] == wave:
+                replies.append(message[2:])
+        if status is not None:
+            break
+        idle = all(r[0] for r in replies)
+        counts = (sent, sum(r[1] for r in replies), sum(r[2] for r in replies))
+        if idle and counts[0] + counts[1] == counts[2]:
+            if previous == counts:
+                status = SOLVED if best_key is not None else UNSOLVABLE
+            previous = counts
+        else:
+            previous = None
+
+    # Follow parent records back through their owners to get the plan
+    plan = None
+    if status == SOLVED:
+        plan = list()
+        key, owner = best_key, best_owner
+        while True:
+            inboxes[owner].put(('trace', key))
+            message = _receive(results, processes)
+            while message[0] != 'record':
+                message = _receive(results, processes)
+            _, parent, action = message
+            if parent is None:
+                break
+            plan.append(problem.grounded_actions[action])
+            key, owner = parent, _owner(problem, parent, workers)
+        plan.reverse()
+
+    stats = SearchStatistics(getattr(problem, 'grounding_time', 0.0))
+    for inbox in inboxes:
+        inbox.put(('stop',))
+    for _ in processes:
+        message = _receive(results, processes)
+        while message[0] != 'statistics':
+            message = _receive(results, processes)
+        for name, value in message[1].items():
+            if name.startswith('peak'):
+                value = max(value, getattr(stats, name))
+            else:
+                value += getattr(stats, name)
+            setattr(stats, name, value)
+    stats.search_time = time() - start
+
+    goal_state = None
+    if best_key is not None:
+        goal_state = problem.make_state(best_key[0], best_key[1],
+                                        state0.cost + best_cost)
+    return SearchResult(status, state0, stats, plan,
+                        goal_state if plan is not None else None)
+
+def _receive(results, processes, deadline=None):
+    """
+    Returns the next message from the worker processes, or None if the
+    deadline (a time) passes first; raises RuntimeError if a worker has
+    failed, since its messages will never arrive
+    """
+    while True:
+        timeout = 0.1
+        if deadline is not None:
+            timeout = min(timeout, deadline - time())
+            if timeout <= 0:
+                return None
+        try:
+            return results.get(timeout=timeout)
+        except Empty:
+            pass
+        for process in processes:
+            if process.exitcode:
+                raise RuntimeError('Worker process failed with exit code %d'
+                                   % process.exitcode)
+
+def _owner(problem, key, workers, zobrist=None):
+    """
+    Returns the index of the worker owning a state (bits, values), given
+    the Zobrist key of its bits if it is known (such as a State's key)
+    """
+    bits, values = key
+    h = problem.atoms.zobrist(bits) if zobrist is None else zobrist
+    if values:
+        h ^= hash(tuple(-1 if v is None else v for v in values))
+    return h % workers
+
+def _hda_worker(problem, factory, index, inboxes, results, exchange_interval):
+    heuristic = null_heuristic if factory is None else factory(problem)
+    inbox = inboxes[index]
+    workers = len(inboxes)
+    goal_mask = problem.goal_mask
+    num_goals = problem.num_goals
+    stats = SearchStatistics()
+
+    bound = INFINITY
+    sent = 0
+    received = 0
+    fringe = list()
+    best_cost = dict()
+    # Closed states map to (cost, parent key, action index)
+    closed = dict()
+    parents = dict()
+    outbox = [list() for _ in inboxes]
+    counter = count()
+
+    def flush():
+        n = 0
+        for i, states in enumerate(outbox):
+            if states:
+                inboxes[i].put(('states', states))
+                n += len(states)
+                outbox[i] = list()
+        return n
+
+    def insert(key, cost, parent, action):
+        if key in closed:
+            if closed[key][0] <= cost:
+                stats.duplicates += 1
+                return
+            del closed[key]
+        if best_cost.get(key, INFINITY) <= cost:
+            stats.duplicates += 1
+            return
+        state = problem.make_state(key[0], key[1], cost)
+        t = time()
+        h = heuristic(state)
+        stats.heuristic_time += time() - t
+        stats.evaluations += 1
+        if cost + h >= bound:
+            return
+        best_cost[key] = cost
+        parents[key] = (parent, action)
+        heapq.heappush(fringe, (cost + h, -cost, next(counter), key))
+
+    def has_work():
+        return bool(fringe) and fringe[0][0] < bound
+
+    action_index = problem.action_index
+    while True:
+        # Handle messages
+        blocking = not has_work()
+        while True:
+            try:
+                message = inbox.get(timeout=0.01) if blocking else inbox.get_nowait()
+            except Empty:
+                break
+            blocking = False
+            kind = message[0]
+            if kind == 'states':
+                received += len(message[1])
+                for key, cost, parent, action in message[1]:
+                    insert(key, cost, parent, action)
+            elif kind == 'bound':
+                bound = min(bound, message[1])
+            elif kind == 'probe':
+                sent += flush()
+                results.put(('probe', message[1], not has_work(),
+                             sent, received))
+            elif kind == 'trace':
+                parent, action = closed[message[1]][1:]
+                results.put(('record', parent, action))
+            elif kind == 'stop':
+                results.put(('statistics', stats.as_dict()))
+                return
+
+        # Expand nodes
+        for _ in range(exchange_interval):
+            if not has_work():
+                break
+            f, g, _, key = heapq.heappop(fringe)
+            cost = best_cost.get(key)
+            if cost is None or -g != cost:
+                stats.duplicates += 1
+                continue
+            del best_cost[key]
+            closed[key] = (cost,) + parents.pop(key)
+            stats.expanded += 1
+            state = problem.make_state(key[0], key[1], cost)
+            if state.holds(goal_mask, num_goals):
+                bound = min(bound, cost)
+                results.put(('solution', cost, key, index))
+                continue
+
+            t = time()
+            successors = [(state.apply(a), action_index[a])
+                          for a in problem.applicable_actions(state)]
+            stats.successor_time += time() - t
+            stats.generated += len(successors)
+            for successor, a in successors:
+                skey = (successor.bits, successor.values)
+                owner = _owner(problem, skey, workers, successor.key)
+                if owner == index:
+                    insert(skey, successor.cost, key, a)
+                else:
+                    outbox[owner].append((skey, successor.cost, key, a))
+            stats.peak_open = max(stats.peak_open, len(fringe))
+            stats.peak_closed = max(stats.peak_closed, len(closed))
+        sent += flush()
+
+def portfolio_planner(problem, configs, timeout=None, first=True,
+                      verbose=True):
+    """
+    Runs several search configurations concurrently, returning a plan
+    found by one of them. See portfolio_search for the arguments.
+    """
+    result, index = portfolio_search(problem, configs, timeout, first)
+    if verbose:
+        if result.plan is not None:
+            print('Configuration %d: %s' % (index, result))
+            print('Plan length: %d' % len(result.plan))
+            print('Plan cost: %g' % result.cost)
+        else:
+            print('Search stopped: %s' % result.status)
+    return result.plan
+
+def portfolio_search(problem, configs, timeout=None, first=True):
+    """
+    Runs each search configuration in its own process on the same problem,
+    returning (SearchResult, index of the configuration it came from). The
+    index is None if no configuration found a plan. Searches still running
+    when the portfolio returns are terminated, and a configuration whose
+    search raises an exception (or whose process dies) counts as finished
+    with status FAILED.
+    Arguments:
+    problem   - a pyddl Problem
+    configs   - list of dicts of keyword arguments for search, e.g.
+                dict(heuristic=hff_heuristic, strategy='gbfs'); the
+                heuristic is a picklable function returning a heuristic
+                for the problem (as for hda_search), or None for
+                null_heuristic
+    timeout   - maximum number of seconds to wait for the searches
+    first     - if True, returns the first plan found; otherwise waits for
+                all searches (until the timeout) and returns the cheapest
+    """
+    start = time()
+    results = multiprocessing.Queue()
+    processes = [multiprocessing.Process(
+                    target=_portfolio_worker,
+                    args=(problem, config, i, timeout, results))
+                 for i, config in enumerate(configs)]
+    for process in processes:
+        process.daemon = True
+        process.start()
+
+    best = None
+    statuses = list()
+    finished = set()
+    try:
+        while len(finished) < len(processes):
+            remaining = 0.1
+            if timeout is not None:
+                remaining = min(remaining, timeout - (time() - start))
+                if remaining <= 0:
+                    break
+            try:
+                message = results.get(timeout=remaining)
+            except Empty:
+                # Processes that died without reporting have failed
+                for i, process in enumerate(processes):
+                    if process.exitcode and i not in finished:
+                        finished.add(i)
+                        statuses.append(FAILED)
+                continue
+            index, status, plan, statistics = message
+            if index in finished:
+                continue
+            finished.add(index)
+            statuses.append(status)
+            if plan is not None and (best is None or
+                                     plan[1] < best[2][1]):
+                best = (index, status, plan, statistics)
+                if first:
+                    break
+    finally:
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+        for process in processes:
+            process.join()
+
+    stats = SearchStatistics(getattr(problem, 'grounding_time', 0.0))
+    state0 = problem.initial_state
+    if best is None:
+        if len(finished) < len(processes):
+            status = TIME_LIMIT
+        elif UNSOLVABLE in statuses:
+            status = UNSOLVABLE
+        else:
+            status = statuses[-1] if statuses else UNSOLVABLE
+        stats.search_time = time() - start
+        return SearchResult(status, state0, stats), None
+
+    index, status, (actions, _), statistics = best
+    for name, value in statistics.items():
+        setattr(stats, name, value)
+    monotone = configs[index].get('monotone', False)
+    state = configs[index].get('state0') or state0
+    plan = list()
+    for a in actions:
+        action = problem.grounded_actions[a]
+        state = state.apply(action, monotone)
+        plan.append(action)
+    return SearchResult(status, state0, stats, plan, state), index
+
+def _portfolio_worker(problem, config, index, timeout, results):
+    config = dict(config)
+    factory = config.pop('heuristic', None)
+    try:
+        heuristic = null_heuristic if factory is None else factory(problem)
+        config.setdefault('time_limit', timeout)
+        result = search(problem, heuristic, **config)
+    except Exception:
+        results.put((index, FAILED, None, dict()))
+        raise
+    plan = None
+    if result.plan is not None:
+        plan = ([problem.action_index[a] for a in result.plan], result.cost)
+    results.put((index, result.status, plan, result.statistics.as_dict()))
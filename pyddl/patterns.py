@@ -0,0 +1,422 @@
+"""
+Pattern database heuristics: distances to the goal in projections of
+a problem onto subsets of its atoms, precomputed once and looked up
+for each state
+"""
+from array import array
+import hashlib
+import heapq
+import mmap
+import os
+import pickle
+import struct
+
+from .planner import INFINITY
+
+__all__ = ['pdb_heuristic', 'select_patterns', 'PatternDatabase', 'PDB_SIZE']
+
+# Default maximum number of abstract states in a pattern database
+PDB_SIZE = 100000
+
+PDB_VERSION = 1
+
+def pdb_heuristic(problem, patterns=None, additive=True, max_size=PDB_SIZE,
+                  directory=None):
+    """
+    Pattern database heuristic: combines the goal distances of several
+    projections of the problem, each looked up in a precomputed table.
+    If additive, each action's cost is only counted in the first pattern
+    whose atoms it changes, so the sum of the databases is admissible;
+    otherwise every database uses the full costs and their max is taken.
+    Arguments:
+    problem   - a pyddl Problem
+    patterns  - list of patterns (collections of atoms) to project onto;
+                chosen with select_patterns by default
+    additive  - if True, sums the databases rather than taking their max
+    max_size  - maximum number of abstract states per automatic pattern
+    directory - if given, databases are saved to this directory (which is
+                created if necessary) and memory-mapped from it by later
+                calls with the same patterns
+    """
+    if patterns is None:
+        patterns = select_patterns(problem, max_size)
+    groups = [_groups(problem, p) for p in patterns]
+    costs = [None]*len(groups)
+    if additive:
+        costs = _partition_costs(problem, groups)
+    databases = [PatternDatabase(problem, p, c, directory)
+                 for p, c in zip(patterns, costs)]
+    lookups = [db.lookup for db in databases]
+
+    if additive:
+        def h(state):
+            bits = state.bits
+            return sum(lookup(bits) for lookup in lookups)
+    else:
+        def h(state):
+            bits = state.bits
+            return max([lookup(bits) for lookup in lookups] or [0])
+    h.databases = databases
+    return h
+
+def select_patterns(problem, max_size=PDB_SIZE):
+    """
+    Chooses patterns for pdb_heuristic: atoms are grouped into variables
+    (atoms of the same predicate that actions exchange for one another,
+    such as the positions of one tile, at most one of which can hold),
+    and the variables containing goals are packed into patterns of at
+    most max_size abstract states. Variables changed by fewer actions
+    are packed first, so that with additive databases each action's cost
+    goes to the most specific pattern.
+    """
+    atoms = problem.atoms
+    actions = _relevant_actions(problem)
+    groups = _groups(problem, atoms.atoms, actions)
+    goal_mask = problem.goal_mask
+    goal_groups = list()
+    for group in groups:
+        mask = atoms.mask(group)
+        if not mask & goal_mask:
+            continue
+        if len(group) + 1 > max_size:
+            # Too many values; keep just the goal atoms
+            group = [g for g in group if (1 << atoms.index[g]) & goal_mask]
+            mask = atoms.mask(group)
+        changed = 0
+        for a in actions:
+            _, add, delete = a.masks(atoms)
+            if (add | delete) & mask:
+                changed += 1
+        goal_groups.append((changed, group))
+    goal_groups.sort(key=lambda g: g[0])
+
+    patterns = list()
+    pattern, size = list(), 1
+    for _, group in goal_groups:
+        radix = len(group) + 1
+        if pattern and size*radix > max_size:
+            patterns.append(pattern)
+            pattern, size = list(), 1
+        pattern.extend(group)
+        size *= radix
+    if pattern:
+        patterns.append(pattern)
+    return patterns
+
+class PatternDatabase(object):
+
+    def __init__(self, problem, pattern, costs=None, directory=None):
+        """
+        Goal distances of all states of the projection of a problem onto
+        a pattern, computed by a backward uniform-cost (for unit costs,
+        breadth-first) search over the abstract state space. Abstract
+        states are numbered by the atoms they contain, so the distances
+        are kept in a flat array, with the smallest item type that fits.
+        @arg problem : a pyddl Problem
+        @arg pattern : collection of atoms to project the problem onto
+        @arg costs : cost of each of problem.grounded_actions (the action
+                     costs by default, with 0 for costs given by functions)
+        @arg directory : if given, the table is loaded from (or saved to)
+                         a file in this directory named by a hash of the
+                         projected problem
+        """
+        self._bind(problem, _groups(problem, pattern))
+        abstract = self._abstract_actions(problem, costs)
+        path = None
+        if directory is not None:
+            if not os.path.isdir(directory):
+                os.makedirs(directory)
+            key = hashlib.sha1(pickle.dumps(
+                (PDB_VERSION, self.groups, self.goals,
+                 self._key_actions(abstract)), protocol=2)).hexdigest()
+            path = os.path.join(directory, 'pdb-%s.pdb' % key)
+            if os.path.exists(path):
+                self._load_table(path)
+                return
+        self.table, self.unreachable = self._distances(abstract)
+        if path is not None:
+            self.save(path)
+
+    def _bind(self, problem, groups):
+        """Numbers the abstract states of the pattern's groups of atoms"""
+        atoms = problem.atoms
+        self.groups = tuple(tuple(g) for g in groups)
+        self.pattern = tuple(a for g in self.groups for a in g)
+        self.mask = atoms.mask(self.pattern)
+        in_pattern = set(self.pattern)
+        self.goals = tuple(g for g in problem.goals if g in in_pattern)
+        self.goal_mask = atoms.mask(self.goals)
+        # Each group is a digit: 0 if none of its atoms hold, else the
+        # position of the atom that holds plus one
+        self.weights = dict()
+        self.radices = list()
+        size = 1
+        for group in self.groups:
+            for j, atom in enumerate(group):
+                self.weights[atoms.index[atom]] = size*(j + 1)
+            self.radices.append((size, len(group) + 1,
+                                 [atoms.index[a] for a in group]))
+            size *= len(group) + 1
+        self.size = size
+        self.atoms = atoms
+
+    def _abstract_actions(self, problem, costs):
+        """
+        Returns the (precondition, add, delete, cost) bitsets of the
+        actions that change the pattern, restricted to its atoms
+        """
+        atoms = problem.atoms
+        index = problem.action_index
+        abstract = list()
+        for action in _relevant_actions(problem):
+            pre, add, delete = action.masks(atoms)
+            add &= self.mask
+            delete &= self.mask & ~add
+            if not add and not delete:
+                continue
+            if costs is None:
+                cost = 0 if isinstance(action.cost, tuple) else action.cost
+            else:
+                cost = costs[index[action]]
+            abstract.append((pre & self.mask, add, delete, cost))
+        return abstract
+
+    def _key_actions(self, abstract):
+        atoms = self.atoms.atoms
+        # Atoms are compared by repr, as their arguments may mix types
+        return sorted(repr(tuple(sorted(repr(atoms[i]) for i in _indices(m))
+                                 for m in a[:3]) + (a[3],)) for a in abstract)
+
+    def _distances(self, abstract):
+        size = self.size
+        # Actions are indexed by one of their preconditions, so only
+        # those with a precondition in the abstract state are tried
+        anchored = dict()
+        for a in abstract:
+            anchor = a[0] & -a[0]
+            anchored.setdefault(anchor, list()).append(a)
+        free = anchored.pop(0, [])
+
+        predecessors = [None]*size
+        goals = list()
+        goal_mask = self.goal_mask
+        for s in range(size):
+            bits = self.decode(s)
+            if bits & goal_mask == goal_mask:
+                goals.append(s)
+            candidates = list(free)
+            b = bits
+            while b:
+                low = b & -b
+                candidates.extend(anchored.get(low, ()))
+                b ^= low
+            for pre, add, delete, cost in candidates:
+                if pre & ~bits:
+                    continue
+                successor = (bits & ~delete) | add
+                if successor == bits:
+                    continue
+                t = self.rank(successor)
+                if predecessors[t] is None:
+                    predecessors[t] = list()
+                predecessors[t].append((cost, s))
+
+        distance = [INFINITY]*size
+        heap = [(0, s) for s in goals]
+        for s in goals:
+            distance[s] = 0
+        while heap:
+            d, t = heapq.heappop(heap)
+            if d > distance[t] or predecessors[t] is None:
+                continue
+            for cost, s in predecessors[t]:
+                if d + cost < distance[s]:
+                    distance[s] = d + cost
+                    heapq.heappush(heap, (d + cost, s))
+
+        finite = [d for d in distance if d != INFINITY]
+        if all(d == int(d) for d in finite):
+            top = max(finite or [0])
+            for typecode, unreachable in (('B', 0xff), ('H', 0xffff),
+                                          ('I', 0xffffffff)):
+                if top < unreachable:
+                    table = array(typecode, [unreachable]*size)
+                    for s, d in enumerate(distance):
+                        if d != INFINITY:
+                            table[s] = int(d)
+                    return table, unreachable
+        return array('d', distance), INFINITY
+
+    def decode(self, s):
+        """Returns the bitset of atoms of an abstract state number"""
+        bits = 0
+        for size, radix, indices in self.radices:
+            j = (s // size) % radix
+            if j:
+                bits |= 1 << indices[j - 1]
+        return bits
+
+    def rank(self, bits):
+        """Returns the number of the abstract state of a bitset"""
+        weights = self.weights
+        s = 0
+        bits &= self.mask
+        while bits:
+            low = bits & -bits
+            s += weights[low.bit_length() - 1]
+            bits ^= low
+        return s
+
+    def lookup(self, bits):
+        """Returns the goal distance of the abstraction of a bitset"""
+        d = self.table[self.rank(bits)]
+        return INFINITY if d == self.unreachable else d
+
+    def __call__(self, state):
+        return self.lookup(state.bits)
+
+    def save(self, path):
+        """
+        Writes the database to a file, which load can memory-map. The
+        file is written to a temporary name first, so that concurrent
+        readers never see a partial table.
+        """
+        header = pickle.dumps(dict(
+            version=PDB_VERSION, groups=self.groups, goals=self.goals,
+            typecode=self.table.typecode, unreachable=self.unreachable,
+            size=self.size), protocol=2)
+        padding = -(8 + len(header)) % 8
+        tmp = '%s.%d.tmp' % (path, os.getpid())
+        with open(tmp, 'wb') as f:
+            f.write(struct.pack('<Q', len(header)))
+            f.write(header)
+            f.write(b'\0'*padding)
+            f.write(memoryview(self.table).cast('B'))
+        os.rename(tmp, path)
+
+    @staticmethod
+    def load(path, problem):
+        """
+        Memory-maps a database saved with save, for a problem with the
+        same pattern atoms and goals
+        """
+        db = PatternDatabase.__new__(PatternDatabase)
+        header = db._load_table(path)
+        db._bind(problem, header['groups'])
+        if db.goals != header['goals']:
+            raise ValueError('Pattern database %s is for other goals' % path)
+        return db
+
+    def _load_table(self, path):
+        with open(path, 'rb') as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        n, = struct.unpack_from('<Q', self._map)
+        header = pickle.loads(self._map[8:8 + n])
+        if header['version'] != PDB_VERSION:
+            raise ValueError('Unsupported pattern database version: %s'
+                             % header['version'])
+        start = 8 + n + (-(8 + n) % 8)
+        view = memoryview(self._map)[start:]
+        self.table = view.cast(header['typecode'])
+        self.unreachable = header['unreachable']
+        return header
+
+def _indices(bits):
+    while bits:
+        low = bits & -bits
+        yield low.bit_length() - 1
+        bits ^= low
+
+def _relevant_actions(problem):
+    """
+    Returns the grounded actions whose static preconditions (atoms no
+    action changes) hold initially; the others can never be applied
+    """
+    atoms = problem.atoms
+    actions = problem.grounded_actions
+    changed = 0
+    for a in actions:
+        _, add, delete = a.masks(atoms)
+        changed |= add | delete
+    static = problem.initial_state.bits & ~changed
+    return [a for a in actions
+            if a.masks(atoms)[0] & ~changed & ~static == 0]
+
+def _groups(problem, pattern, actions=None):
+    """
+    Splits a pattern into groups of atoms of the same predicate that
+    actions exchange for one another, at most one of which holds in any
+    reachable state; other atoms form groups of their own
+    """
+    atoms = problem.atoms
+    if actions is None:
+        actions = _relevant_actions(problem)
+    pattern = [atoms.atoms[atoms.intern(p)] for p in pattern]
+    in_pattern = set(atoms.index[p] for p in pattern)
+    parent = dict((i, i) for i in in_pattern)
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    for a in actions:
+        _, add, delete = a.masks(atoms)
+        for i in _indices(add):
+            if i not in in_pattern:
+                continue
+            for j in _indices(delete):
+                if (j in in_pattern and
+                        atoms.atoms[i][0] == atoms.atoms[j][0]):
+                    parent[find(i)] = find(j)
+
+    members = dict()
+    for p in pattern:
+        members.setdefault(find(atoms.index[p]), list()).append(p)
+    init = problem.initial_state.bits
+    groups = list()
+    for group in members.values():
+        if len(group) > 1 and not _exclusive(atoms, atoms.mask(group),
+                                             init, actions):
+            groups.extend([p] for p in group)
+        else:
+            groups.append(group)
+    return groups
+
+def _exclusive(atoms, mask, init, actions):
+    """
+    Checks that at most one atom of a mask holds initially, and that
+    every action making one hold requires and deletes another
+    """
+    if bin(init & mask).count('1') > 1:
+        return False
+    for a in actions:
+        pre, add, delete = a.masks(atoms)
+        # Atoms both added and deleted are kept
+        delete &= ~add
+        added = add & mask & ~(pre & ~delete)
+        if not added:
+            continue
+        if (bin(added).count('1') > 1 or
+                bin(pre & delete & mask).count('1') != 1):
+            return False
+    return True
+
+def _partition_costs(problem, groups):
+    """
+    Returns a list of action costs for each pattern (given as groups of
+    atoms), giving each action's cost to the first pattern it changes
+    """
+    atoms = problem.atoms
+    masks = [atoms.mask(a for group in pattern for a in group)
+             for pattern in groups]
+    costs = [[0]*len(problem.grounded_actions) for _ in groups]
+    for i, action in enumerate(problem.grounded_actions):
+        _, add, delete = action.masks(atoms)
+        cost = 0 if isinstance(action.cost, tuple) else action.cost
+        for k, mask in enumerate(masks):
+            if (add | delete) & mask:
+                costs[k][i] = cost
+                break
+    return costs
@@ -0,0 +1,280 @@
+"""
+Reading domains and problems from PDDL files (STRIPS with typing,
+numeric fluents and action costs). Files are tokenized in chunks, and
+the initial state of a problem is converted one atom at a time, so large
+problem files are never held in memory as a whole.
+"""
+import re
+
+from .pyddl import Domain, Problem, Action, neg
+from .numeric import NUM_OPS
+
+__all__ = ['parse_domain', 'parse_problem', 'parse']
+
+# Tokens are parentheses, comments (skipped) and other symbols
+_TOKEN = re.compile(r';[^\n]*|[()]|[^\s();]+')
+
+# Size of the chunks in which files are read
+CHUNK_SIZE = 1 << 16
+
+# Function whose increases give the cost of an action
+TOTAL_COST = 'total-cost'
+
+def parse_domain(domain_file):
+    """
+    Reads a Domain from a PDDL domain file (a path or file object). The
+    domain's types (a dictionary of parent types keyed by type) and
+    constants (a list of (name, type) pairs) are kept as the attributes
+    types and constants, which parse_problem uses.
+    """
+    with _open(domain_file) as f:
+        tokens = _tokenize(f)
+        define = _read(tokens)
+    _expect(define, 'define', 'domain')
+
+    requirements = set()
+    types = dict()
+    constants = list()
+    actions = list()
+    for section in define[2:]:
+        if not isinstance(section, list) or not section:
+            raise ValueError('Unexpected PDDL domain section: %s' % section)
+        keyword = section[0]
+        if keyword == ':requirements':
+            requirements.update(section[1:])
+        elif keyword == ':types':
+            for name, parent in _typed_list(section[1:]):
+                types[name] = parent
+        elif keyword == ':constants':
+            constants.extend(_typed_list(section[1:]))
+        elif keyword == ':action':
+            actions.append(_action(section, requirements))
+        elif keyword not in (':predicates', ':functions'):
+            raise ValueError('Unsupported PDDL domain section: %s' % keyword)
+
+    domain = Domain(actions)
+    domain.name = define[1][1]
+    domain.types = types
+    domain.constants = constants
+    return domain
+
+def parse_problem(problem_file, domain, **kwargs):
+    """
+    Reads a Problem from a PDDL problem file (a path or file object)
+    over a Domain returned by parse_domain. Other keyword arguments
+    (such as prune or cache) are passed to Problem.
+    """
+    types = getattr(domain, 'types', dict())
+    objects = list(getattr(domain, 'constants', ()))
+    init = list()
+    goal = list()
+    with _open(problem_file) as f:
+        tokens = _tokenize(f)
+        if _next(tokens) != '(' or _next(tokens) != 'define':
+            raise ValueError('Expected (define (problem ...) ...)')
+        _expect(_read(tokens), 'problem')
+        for token in tokens:
+            if token == ')':
+                break
+            if token != '(':
+                raise ValueError('Unexpected PDDL token: %s' % token)
+            keyword = _next(tokens)
+            if keyword == ':init':
+                # The initial state is converted while it is read
+                for token in tokens:
+                    if token == ')':
+                        break
+                    atom = _read(tokens, token)
+                    if atom[0] == '=':
+                        function = _function(atom[1])
+                        if function[0] != TOTAL_COST:
+                            init.append(('=', function, _number(atom[2])))
+                    else:
+                        init.append(_atom(atom))
+                continue
+            section = _read_list(tokens)
+            if keyword == ':objects':
+                objects.extend(_typed_list(section))
+            elif keyword == ':goal':
+                goal.extend(_conditions(section[0]))
+            elif keyword not in (':domain', ':requirements', ':metric'):
+                raise ValueError('Unsupported PDDL problem section: %s'
+                                 % keyword)
+
+    # Objects belong to their type and all of its ancestors
+    typed = dict((t, list()) for t in set(types) | set(types.values()))
+    typed.setdefault('object', list())
+    for name, t in objects:
+        while t is not None:
+            typed.setdefault(t, list()).append(name)
+            t = types.get(t, 'object' if t != 'object' else None)
+    typed = dict((t, tuple(names)) for t, names in typed.items())
+    return Problem(domain, typed, init, goal, **kwargs)
+
+def parse(domain_file, problem_file, **kwargs):
+    """Reads a Problem from PDDL domain and problem files"""
+    return parse_problem(problem_file, parse_domain(domain_file), **kwargs)
+
+class _open(object):
+    """Opens a path for reading, or passes an open file through"""
+
+    def __init__(self, source):
+        self.source = source
+        self.file = None
+
+    def __enter__(self):
+        if hasattr(self.source, 'read'):
+            return self.source
+        self.file = open(self.source)
+        return self.file
+
+    def __exit__(self, *exc_info):
+        if self.file is not None:
+            self.file.close()
+
+def _tokenize(f, chunk_size=CHUNK_SIZE):
+    """
+    Yields the lowercase tokens of a file, reading it in chunks. A token
+    or comment running to the end of a chunk is kept for the next one.
+    """
+    rest = ''
+    while True:
+        chunk = f.read(chunk_size)
+        text = rest + chunk
+        rest = ''
+        for m in _TOKEN.finditer(text):
+            if chunk and m.end() == len(text):
+                rest = m.group()
+                break
+            token = m.group()
+            if token[0] != ';':
+                yield token.lower()
+        if not chunk:
+            return
+
+def _next(tokens):
+    for token in tokens:
+        return token
+    raise ValueError('Unexpected end of PDDL file')
+
+def _read(tokens, token=None):
+    """Reads an expression: a symbol, or a list of expressions"""
+    if token is None:
+        token = _next(tokens)
+    if token == ')':
+        raise ValueError('Unexpected ) in PDDL file')
+    if token != '(':
+        return token
+    return _read_list(tokens)
+
+def _read_list(tokens):
+    """Reads the rest of a list whose ( has already been read"""
+    expr = list()
+    for token in tokens:
+        if token == ')':
+            return expr
+        expr.append(_read(tokens, token))
+    raise ValueError('Unexpected end of PDDL file')
+
+def _expect(expr, *keywords):
+    if not isinstance(expr, list) or not expr or expr[0] != keywords[0]:
+        raise ValueError('Expected (%s ...) in PDDL file' % keywords[0])
+    if len(keywords) > 1:
+        _expect(expr[1], *keywords[1:])
+
+def _typed_list(items):
+    """Returns (name, type) pairs for a list like 'a b - t c' """
+    pairs = list()
+    names = list()
+    items = iter(items)
+    for item in items:
+        if item == '-':
+            t = _next(items)
+            if isinstance(t, list):
+                raise ValueError('Unsupported PDDL type: %s' % t)
+            pairs.extend((name, t) for name in names)
+            names = list()
+        else:
+            names.append(item)
+    pairs.extend((name, 'object') for name in names)
+    return pairs
+
+def _action(section, requirements):
+    name = section[1]
+    fields = dict(zip(section[2::2], section[3::2]))
+    parameters = [(t, p) for p, t in _typed_list(fields.get(':parameters', ()))]
+    preconditions = _conditions(fields.get(':precondition', []))
+    effects = list()
+    cost = 0 if ':action-costs' in requirements else 1
+    for effect in _conjuncts(fields.get(':effect', [])):
+        if effect[0] == 'not':
+            effects.append(neg(_atom(effect[1])))
+        elif effect[0] in ('increase', 'decrease'):
+            function = _function(effect[1])
+            value = _value(effect[2])
+            if function[0] == TOTAL_COST and effect[0] == 'increase':
+                cost = value
+            else:
+                effects.append(('+=' if effect[0] == 'increase' else '-=',
+                                function, value))
+        else:
+            effects.append(_atom(effect))
+    return Action(name, parameters, preconditions, effects, cost=cost)
+
+def _conjuncts(expr):
+    """Yields the conjuncts of a (possibly nested) conjunction"""
+    if not expr:
+        return
+    if expr[0] == 'and':
+        for e in expr[1:]:
+            for c in _conjuncts(e):
+                yield c
+    else:
+        yield expr
+
+def _conditions(expr):
+    """Converts a conjunction of atoms and numeric comparisons"""
+    conditions = list()
+    for c in _conjuncts(expr):
+        if c[0] in NUM_OPS and (isinstance(c[1], list) or
+                                isinstance(c[2], list) or
+                                _is_number(c[1]) or _is_number(c[2])):
+            conditions.append((c[0], _value(c[1]), _value(c[2])))
+        else:
+            conditions.append(_atom(c))
+    return conditions
+
+def _atom(expr):
+    if (not isinstance(expr, list) or not expr or expr[0] in NUM_OPS or
+            expr[0] in ('not', 'or', 'imply', 'exists', 'forall', 'when') or
+            any(isinstance(x, list) for x in expr)):
+        raise ValueError('Unsupported PDDL atom: %s' % expr)
+    return tuple(expr)
+
+def _function(expr):
+    if not isinstance(expr, list):
+        raise ValueError('Expected a PDDL function term: %s' % expr)
+    return _atom(expr)
+
+def _value(expr):
+    """Converts a number or function term"""
+    if isinstance(expr, list):
+        return _function(expr)
+    return _number(expr)
+
+def _is_number(token):
+    try:
+        float(token)
+    except (TypeError, ValueError):
+        return False
+    return True
+
+def _number(token):
+    try:
+        return int(token)
+    except (TypeError, ValueError):
+        try:
+            return float(token)
+        except (TypeError, ValueError):
+            raise ValueError('Unsupported PDDL numeric expression: %s'
+                             % token)
@@ -1,11 +1,26 @@
-from __future__ import print_function
 from time import time
+import os
+import sys
+from collections import OrderedDict
+from itertools import count
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+import asyncio
 import heapq
 
+from .pyddl import State, _make_state
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+INFINITY = float('inf')
+
 def planner(problem, heuristic=None, state0=None, goal=None,
-            monotone=False, verbose=True):
+            monotone=False, verbose=True, engine=None, **kwargs):
     """
-    Implements A* search to find a plan for the given problem.
+    Implements A* search to find a minimum-cost plan for the given problem.
     Arguments:
     problem   - a pyddl Problem
     heuristic - a heuristic to use (h(state) = 0 by default)
@@ -14,53 +29,651 @@ def planner(problem, heuristic=None, state0=None, goal=None,
                 (default is (problem.goals, problem.num_goals))
     monotone  - if True, only applies actions by ignoring delete lists
     verbose   - if True, prints statistics before returning
+    engine    - search function to use (search by default), such as
+                ida_search or sma_search to bound memory use
+    Other keyword arguments (search strategy and limits) are passed to
+    the engine; returns the plan, or None if none was found.
+    """
+    if engine is None:
+        engine = search
+    result = engine(problem, heuristic, state0, goal, monotone, **kwargs)
+    if verbose:
+        stats = result.statistics
+        print('States Explored: %d' % stats.expanded)
+        if result.plan is not None:
+            print('Time per state: %.3f ms'
+                  % (1000*stats.search_time / max(stats.expanded, 1)))
+            print('Plan length: %d' % len(result.plan))
+            print('Plan cost: %g' % result.cost)
+        elif result.status != SOLVED:
+            print('Search stopped: %s' % result.status)
+        if result.cache is not None:
+            print('Heuristic cache hits/misses: %d/%d'
+                  % (result.cache.hits, result.cache.misses))
+    return result.plan
+
+# Reasons for a search to stop
+SOLVED = 'solved'
+UNSOLVABLE = 'unsolvable'
+EXPANSION_LIMIT = 'expansion limit'
+TIME_LIMIT = 'time limit'
+MEMORY_LIMIT = 'memory limit'
+CANCELLED = 'cancelled'
+
+class SearchStatistics(object):
+
+    def __init__(self, grounding_time=0.0):
+        """
+        Counters and timings collected during a search
+        @arg grounding_time : seconds spent grounding the problem
+        """
+        self.expanded = 0
+        self.generated = 0
+        self.duplicates = 0
+        self.evaluations = 0
+        self.heuristic_time = 0.0
+        self.successor_time = 0.0
+        self.peak_open = 0
+        self.peak_closed = 0
+        self.search_time = 0.0
+        self.grounding_time = grounding_time
+
+    def as_dict(self):
+        """Returns the statistics as a dictionary (e.g. for export)"""
+        return dict(self.__dict__)
+
+    def __str__(self):
+        return '\n'.join([
+            'Expanded: %d' % self.expanded,
+            'Generated: %d' % self.generated,
+            'Duplicates pruned: %d' % self.duplicates,
+            'Heuristic evaluations: %d (%.3f s)'
+            % (self.evaluations, self.heuristic_time),
+            'Successor generation: %.3f s' % self.successor_time,
+            'Peak open/closed: %d/%d' % (self.peak_open, self.peak_closed),
+            'Search time: %.3f s' % self.search_time,
+            'Grounding time: %.3f s' % self.grounding_time,
+        ])
+
+class SearchResult(object):
+
+    def __init__(self, status, initial_state, statistics, plan=None,
+                 state=None, best_state=None, best_h=INFINITY, cache=None):
+        """
+        The outcome of a search
+        @arg status : why the search stopped (SOLVED, UNSOLVABLE,
+                      EXPANSION_LIMIT, TIME_LIMIT, MEMORY_LIMIT
+                      or CANCELLED)
+        @arg initial_state : state the search started from
+        @arg statistics : SearchStatistics for the search
+        @arg plan : list of grounded actions, or None if no plan was found
+        @arg state : goal state reached by the plan
+        @arg best_state : state with the lowest heuristic value seen
+        @arg best_h : heuristic value of best_state
+        @arg cache : the HeuristicCache used, if any
+        """
+        self.status = status
+        self.initial_state = initial_state
+        self.statistics = statistics
+        self.plan = plan
+        self.state = state
+        self.best_state = best_state
+        self.best_h = best_h
+        self.cache = cache
+
+    @property
+    def expanded(self):
+        return self.statistics.expanded
+
+    @property
+    def time(self):
+        return self.statistics.search_time
+
+    @property
+    def cost(self):
+        """Cost of the plan (infinite if there is none)"""
+        if self.state is None:
+            return INFINITY
+        return self.state.cost - self.initial_state.cost
+
+    def __str__(self):
+        return ('%s after %d expansions (%.3f s)'
+                % (self.status, self.expanded, self.time))
+
+class NodeTable(object):
+
+    def __init__(self, problem):
+        """
+        The nodes of a search over a problem, identified by consecutive
+        integer ids. Each state reached is stored once, as its encoding
+        (the bitset of predicates, paired with the function values if the
+        problem has any), and the Zobrist key of its predicates, the id of
+        its parent node, the index of the action reaching it, its lowest
+        known cost and whether it is closed are kept in parallel arrays
+        (costs in a list, so that they keep their type).
+        States are rebuilt from this when needed, and plans are
+        reconstructed by following parent ids.
+        @arg problem : the Problem being searched
+        """
+        self.atoms = problem.atoms
+        self.fluents = problem.fluents
+        self.actions = problem.grounded_actions
+        self.action_index = problem.action_index
+        self.index = dict()
+        self.encodings = list()
+        self.keys = array('Q')
+        self.parent = array('i')
+        self.action = array('i')
+        self.g = list()
+        self.closed = bytearray()
+        self.n_closed = 0
+
+    def find(self, state):
+        """Returns the id of a stored state, or None"""
+        if state.values:
+            return self.index.get((state.bits, state.values))
+        return self.index.get(state.bits)
+
+    def add(self, state, parent=-1, action=None):
+        """Stores a new state reached from a parent node, returning its id"""
+        i = len(self.encodings)
+        encoding = (state.bits, state.values) if state.values else state.bits
+        self.index[encoding] = i
+        self.encodings.append(encoding)
+        self.keys.append(state.key)
+        self.parent.append(parent)
+        self.action.append(-1 if action is None else self.action_index[action])
+        self.g.append(state.cost)
+        self.closed.append(0)
+        return i
+
+    def update(self, i, cost, parent, action):
+        """Records a cheaper path to a stored state"""
+        self.g[i] = cost
+        self.parent[i] = parent
+        self.action[i] = self.action_index[action]
+
+    def close(self, i):
+        self.closed[i] = 1
+        self.n_closed += 1
+
+    def reopen(self, i):
+        self.closed[i] = 0
+        self.n_closed -= 1
+
+    def state(self, i):
+        """Returns the state of node i, with its lowest known cost"""
+        encoding = self.encodings[i]
+        if isinstance(encoding, tuple):
+            bits, values = encoding
+        else:
+            bits, values = encoding, ()
+        return _make_state(self.atoms, self.fluents, bits, values,
+                           self.g[i], None, self.keys[i])
+
+    def plan(self, i):
+        """Returns the actions reaching node i from the root"""
+        plan = list()
+        while self.parent[i] >= 0:
+            plan.append(self.actions[self.action[i]])
+            i = self.parent[i]
+        plan.reverse()
+        return plan
+
+    def __len__(self):
+        return len(self.encodings)
+
+def search(problem, heuristic=None, state0=None, goal=None, monotone=False,
+           **kwargs):
+    """
+    Best-first search for a plan, returning a SearchResult. By default this
+    is A* search, finding a minimum-cost plan; weighted A* and greedy
+    best-first search trade plan cost for speed. The search stops cleanly
+    when any of the given limits is reached.
+    Arguments (see planner for the first five):
+    cache_size - if not None, memoizes heuristic values for up to this many
+                 states (0 for no limit) using a HeuristicCache
+    lazy      - if True, successors are queued with their parent's heuristic
+                value and only evaluated when popped from the fringe (a
+                cache of 100000 states is used unless cache_size is given)
+    strategy  - 'astar' to order the fringe by g + weight*h, or 'gbfs'
+                for greedy best-first search ordered by h (ties by g)
+    weight    - heuristic weight for (weighted) A*; plans found with an
+                admissible heuristic cost at most weight times the optimum
+    bound     - if not None, prunes states with g + h >= bound (used to
+                search only for plans cheaper than a known one)
+    max_expansions - maximum number of states to expand
+    time_limit - maximum number of seconds to search
+    max_closed - maximum number of expanded states to keep in memory
+    memory_limit - maximum resident memory of the process in megabytes
+                   (approximate: checked periodically)
+    on_expand - if not None, called with each state as it is expanded
+    on_generate - if not None, called with each successor generated
+    on_progress - if not None, called with the SearchStatistics about
+                  every progress_interval seconds
+    batch_size - number of nodes popped and expanded together; their
+                 successors are generated with array operations (if NumPy
+                 is installed) and evaluated with the heuristic's batch
+                 method, if it has one. Closed states are reopened when
+                 reached more cheaply, so A* remains optimal.
+    """
+    return Search(problem, heuristic, state0, goal, monotone, **kwargs).run()
+
+class Search(object):
+
+    def __init__(self, problem, heuristic=None, state0=None, goal=None,
+                 monotone=False, cache_size=None, lazy=False,
+                 strategy='astar', weight=1, bound=None, max_expansions=None,
+                 time_limit=None, max_closed=None, memory_limit=None,
+                 on_expand=None, on_generate=None, on_progress=None,
+                 progress_interval=1.0, batch_size=1):
+        """
+        A best-first search that runs a few expansions at a time, so that
+        it can be interleaved with other work (see search for the
+        arguments). The search is advanced with step until its result is
+        set; the time limit counts from the creation of the search.
+        """
+        if strategy == 'astar':
+            def priority(g, h):
+                return g + weight*h
+        elif strategy == 'gbfs':
+            def priority(g, h):
+                return h
+        else:
+            raise ValueError('Unknown search strategy: %s' % strategy)
+        if heuristic is None:
+            heuristic = null_heuristic
+        if lazy and cache_size is None:
+            cache_size = 100000
+        cache = None
+        if cache_size is not None:
+            heuristic = cache = HeuristicCache(heuristic, cache_size or None)
+        elif isinstance(heuristic, HeuristicCache):
+            cache = heuristic
+        if state0 is None:
+            state0 = problem.initial_state
+        if goal is None:
+            goal = (problem.goals, problem.num_goals)
+        if (state0.atoms is not problem.atoms or
+                state0.fluents is not problem.fluents):
+            state0 = State(state0.predicates, state0.f_dict,
+                           atoms=problem.atoms, fluents=problem.fluents)
+        if max_expansions is None:
+            max_expansions = INFINITY
+        if max_closed is None:
+            max_closed = INFINITY
+
+        self.problem = problem
+        self.heuristic = heuristic
+        self.cache = cache
+        self.state0 = state0
+        self.goal_mask = problem.atoms.mask(goal[0])
+        self.num_goals = goal[1]
+        self.monotone = monotone
+        self.lazy = lazy
+        self.priority = priority
+        self.bound = bound
+        self.max_expansions = max_expansions
+        self.time_limit = time_limit
+        self.max_closed = max_closed
+        self.memory_limit = memory_limit
+        self.on_expand = on_expand
+        self.on_generate = on_generate
+        self.on_progress = on_progress
+        self.progress_interval = progress_interval
+        self.batch_size = batch_size
+        self.statistics = SearchStatistics(
+            getattr(problem, 'grounding_time', 0.0))
+        self.result = None
+
+        self.start = time()
+        self.next_progress = self.start + progress_interval
+        # Memory use is checked every 1000 expansions
+        self.next_memory_check = 0
+        # Every state reached is stored once in the node table, with its
+        # lowest known cost; closed states are only reopened when a cheaper
+        # path is found in batch mode
+        self.nodes = NodeTable(problem)
+        root = self.nodes.add(state0)
+        h, = self._evaluate([state0])
+        self.best_state, self.best_h = state0, h
+        # Fringe entries are (priority, -g, insertion order, node id), so
+        # ties are broken by lower g and states are never compared
+        self.counter = count()
+        self.fringe = [(priority(state0.cost, h), -state0.cost,
+                        next(self.counter), root)]
+
+    @property
+    def done(self):
+        return self.result is not None
+
+    def _evaluate(self, states):
+        t = time()
+        hs = evaluate_batch(self.heuristic, states)
+        self.statistics.heuristic_time += time() - t
+        self.statistics.evaluations += len(states)
+        return hs
+
+    def _stop(self, status, node=None):
+        self.statistics.search_time = time() - self.start
+        plan = state = None
+        if node is not None:
+            plan = self.nodes.plan(node)
+            state = self.nodes.state(node)
+            if node == 0:
+                state = self.state0
+        self.result = SearchResult(status, self.state0, self.statistics,
+                                   plan, state, self.best_state, self.best_h,
+                                   self.cache)
+        return self.result
+
+    def cancel(self):
+        """Stops the search, whose result then has status CANCELLED"""
+        if self.result is None:
+            self._stop(CANCELLED)
+
+    def run(self):
+        """Runs the search to completion, returning its SearchResult"""
+        return self.step(INFINITY)
+
+    def step(self, n=100):
+        """
+        Expands up to n more states, returning the SearchResult if the
+        search has finished and None otherwise
+        """
+        if self.result is not None:
+            return self.result
+        problem = self.problem
+        stats = self.statistics
+        evaluate = self._evaluate
+        priority = self.priority
+        nodes, fringe = self.nodes, self.fringe
+        g, closed = nodes.g, nodes.closed
+        counter = self.counter
+        goal_mask, num_goals = self.goal_mask, self.num_goals
+        monotone, lazy, bound = self.monotone, self.lazy, self.bound
+        on_expand, on_generate = self.on_expand, self.on_generate
+        batch_size = self.batch_size
+        best_state, best_h = self.best_state, self.best_h
+        target = stats.expanded + n
+        h = None
+
+        def stop(status, node=None):
+            self.best_state, self.best_h = best_state, best_h
+            return self._stop(status, node)
+
+        try:
+            while stats.expanded < target:
+                now = time()
+                if len(fringe) == 0:
+                    return stop(UNSOLVABLE)
+                if stats.expanded >= self.max_expansions:
+                    return stop(EXPANSION_LIMIT)
+                if nodes.n_closed >= self.max_closed:
+                    return stop(MEMORY_LIMIT)
+                if (self.time_limit is not None and
+                        now - self.start > self.time_limit):
+                    return stop(TIME_LIMIT)
+                if (self.memory_limit is not None and
+                        stats.expanded >= self.next_memory_check):
+                    self.next_memory_check = stats.expanded + 1000
+                    if _memory_usage() > self.memory_limit:
+                        return stop(MEMORY_LIMIT)
+                if self.on_progress is not None and now >= self.next_progress:
+                    stats.search_time = now - self.start
+                    self.on_progress(stats)
+                    self.next_progress = now + self.progress_interval
+
+                # Get up to batch_size nodes with minimum evaluation function,
+                # without going over the expansion limit
+                limit = min(batch_size, self.max_expansions - stats.expanded)
+                batch = list()
+                while fringe and len(batch) < limit:
+                    f, neg_cost, _, i = heapq.heappop(fringe)
+                    if closed[i] or -neg_cost > g[i]:
+                        stats.duplicates += 1
+                        continue
+                    node = nodes.state(i) if i else self.state0
+
+                    # With deferred evaluation, requeue nodes whose
+                    # own heuristic value exceeds that of their parent
+                    if lazy:
+                        h, = evaluate([node])
+                        if h < best_h:
+                            best_state, best_h = node, h
+                        if bound is not None and node.cost + h >= bound:
+                            continue
+                        if priority(node.cost, h) > f:
+                            heapq.heappush(fringe, (priority(node.cost, h),
+                                                    neg_cost, next(counter),
+                                                    i))
+                            continue
+
+                    # Goal test; a goal popped after other nodes of the batch
+                    # is requeued so that their successors are considered first
+                    if node.holds(goal_mask, num_goals):
+                        if batch:
+                            heapq.heappush(fringe, (f, neg_cost,
+                                                    next(counter), i))
+                            break
+                        stats.expanded += 1
+                        if on_expand is not None:
+                            on_expand(node)
+                        return stop(SOLVED, i)
+
+                    stats.expanded += 1
+                    if on_expand is not None:
+                        on_expand(node)
+                    nodes.close(i)
+                    batch.append((i, node, h))
+                if not batch:
+                    continue
+
+                # Apply all applicable actions to get successors
+                t = time()
+                if len(batch) > 1:
+                    applicable = problem.successor_generator.applicable_batch(
+                        [node for _, node, _ in batch])
+                else:
+                    applicable = [problem.applicable_actions(batch[0][1])]
+                pending = dict()
+                for (i, node, h), actions in zip(batch, applicable):
+                    stats.generated += len(actions)
+                    for action in actions:
+                        successor = node.apply(action, monotone)
+                        if on_generate is not None:
+                            on_generate(successor)
+                        cost = successor.cost
+                        j = nodes.find(successor)
+                        if j is None:
+                            j = nodes.add(successor, i, action)
+                        else:
+                            if g[j] <= cost:
+                                stats.duplicates += 1
+                                continue
+                            if closed[j]:
+                                if batch_size == 1:
+                                    stats.duplicates += 1
+                                    continue
+                                nodes.reopen(j)
+                            nodes.update(j, cost, i, action)
+                        pending[j] = (successor, h)
+                stats.successor_time += time() - t
+
+                # Compute heuristic and add to fringe
+                pending = list(pending.items())
+                if not lazy:
+                    hs = evaluate([successor for _, (successor, _) in pending])
+                    pending = [(j, (successor, h)) for (j, (successor, _)), h
+                               in zip(pending, hs)]
+                for j, (successor, h) in pending:
+                    cost = g[j]
+                    if not lazy and h < best_h:
+                        best_state, best_h = successor, h
+                    if bound is not None and cost + h >= bound:
+                        continue
+                    heapq.heappush(fringe, (priority(cost, h), -cost,
+                                            next(counter), j))
+                stats.peak_open = max(stats.peak_open, len(fringe))
+                stats.peak_closed = max(stats.peak_closed, nodes.n_closed)
+        finally:
+            self.best_state, self.best_h = best_state, best_h
+        stats.search_time = time() - self.start
+        return None
+
+def solve_all(grounded, instances, heuristic=None, **kwargs):
+    """
+    A generator solving a sequence of problems over the same grounded
+    domain, yielding a SearchResult for each.
+    Arguments:
+    grounded  - a GroundedDomain
+    instances - iterable of (init, goal) pairs as for Problem
+    heuristic - a function returning a heuristic for each problem, such as
+                hff_heuristic (h(state) = 0 by default)
+    Other keyword arguments are passed to search.
+    """
+    for init, goal in instances:
+        problem = grounded.problem(init, goal)
+        h = None if heuristic is None else heuristic(problem)
+        yield search(problem, h, **kwargs)
+
+async def search_async(problem, heuristic=None, state0=None, goal=None,
+                       monotone=False, steps=100, **kwargs):
+    """
+    A coroutine running search, which returns control to the asyncio event
+    loop after every `steps` expansions so that many searches can share one
+    loop. Cancelling the task stops the search. Other arguments are as for
+    search (use on_progress to report progress); returns a SearchResult.
+    """
+    s = Search(problem, heuristic, state0, goal, monotone, **kwargs)
+    while True:
+        result = s.step(steps)
+        if result is not None:
+            return result
+        await asyncio.sleep(0)
+
+def evaluate_batch(heuristic, states):
+    """
+    Evaluates a heuristic on a list of states, using its batch
+    method if it has one
+    """
+    if len(states) > 1 and hasattr(heuristic, 'batch'):
+        return heuristic.batch(states)
+    return [heuristic(state) for state in states]
+
+def _memory_usage():
+    """
+    Current resident memory of this process in megabytes, read from
+    /proc/self/statm; where that is unavailable, the peak resident memory
+    reported by getrusage is used instead (0 if neither is available)
+    """
+    try:
+        with open('/proc/self/statm') as f:
+            pages = int(f.read().split()[1])
+        return pages * (os.sysconf('SC_PAGE_SIZE') / 1048576.0)
+    except (IOError, OSError, ValueError, IndexError, AttributeError):
+        pass
+    try:
+        import resource
+    except ImportError:
+        return 0
+    usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        return usage / 1048576.0
+    return usage / 1024.0
+
+def anytime_planner(problem, heuristic=None, weights=(5, 3, 2, 1.5, 1),
+                    time_limit=None, max_expansions=None, verbose=False,
+                    **kwargs):
+    """
+    Restarting weighted A*: a generator yielding progressively cheaper
+    plans found by weighted A* searches with decreasing weights. Each
+    search only looks for plans cheaper than the last one found, and
+    heuristic values are cached across searches. Stops when the weights
+    are exhausted, when a search finds no cheaper plan, or when the time
+    limit (in seconds) or total number of expansions is reached. If verbose, prints the outcome of each search.
+    Other keyword arguments are passed to search.
     """
     if heuristic is None:
         heuristic = null_heuristic
-    if state0 is None:
-        state0 = problem.initial_state
-    if goal is None:
-        goal = (problem.goals, problem.num_goals)
-
-    states_explored = 0
-    closed = set()
-    fringe = [(heuristic(state0), -state0.cost, state0)]
-    heapq.heapify(fringe)
-    start = time()
-    while True:
-        if len(fringe) == 0:
-            if verbose: print('States Explored: %d' % states_explored)
-            return None
-
-        # Get node with minimum evaluation function from heap
-        h, _, node = heapq.heappop(fringe)
-        states_explored += 1
-
-        # Goal test
-        if node.is_true(*goal):
-            plan = node.plan()
-            dur = time() - start
-            if verbose:
-                print('States Explored: %d' % states_explored)
-                print('Time per state: %.3f ms' % (1000*dur / states_explored))
-                print('Plan length: %d' % node.cost)
-            return plan
-
-        # Expand node if we haven't seen it before
-        if node not in closed:
-            closed.add(node)
-
-            # Apply all applicable actions to get successors
-            successors = set(node.apply(action, monotone)
-                             for action in problem.grounded_actions
-                             if node.is_true(action.preconditions,
-                                             action.num_preconditions))
-
-            # Compute heuristic and add to fringe
-            for successor in successors:
-                if successor not in closed:
-                    f = successor.cost + heuristic(successor)
-                    heapq.heappush(fringe, (f, -successor.cost, successor))
+    heuristic = HeuristicCache(heuristic, kwargs.pop('cache_size', None) or None)
+    deadline = None if time_limit is None else time() + time_limit
+    bound = None
+    for w in weights:
+        remaining = None if deadline is None else deadline - time()
+        if remaining is not None and remaining <= 0:
+            return
+        result = search(problem, heuristic, weight=w, bound=bound,
+                        time_limit=remaining, max_expansions=max_expansions,
+                        **kwargs)
+        if verbose:
+            print('Weight %g: %s (plan cost %g)' % (w, result, result.cost))
+        if result.plan is not None:
+            bound = result.cost
+            yield result.plan
+        # Without a plan below the bound, the last plan is the cheapest
+        if result.status != SOLVED:
+            return
+        if max_expansions is not None:
+            max_expansions -= result.expanded
+
+class HeuristicCache(object):
+
+    def __init__(self, heuristic, maxsize=None):
+        """
+        Memoizes a heuristic by state, evicting the least recently used
+        values once more than maxsize states are cached (if maxsize is
+        None, the cache is unbounded). Keys are the state contents, so
+        cached states' predecessors are not kept alive.
+        """
+        self.heuristic = heuristic
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._values = OrderedDict()
+
+    def __call__(self, state):
+        key = (state.bits, state.values)
+        values = self._values
+        if key in values:
+            self.hits += 1
+            values.move_to_end(key)
+            return values[key]
+        self.misses += 1
+        h = self.heuristic(state)
+        values[key] = h
+        if self.maxsize is not None and len(values) > self.maxsize:
+            values.popitem(last=False)
+        return h
+
+    def batch(self, states):
+        """Evaluates a list of states, batching the uncached ones"""
+        values = self._values
+        hs = list()
+        missing = list()
+        for i, state in enumerate(states):
+            key = (state.bits, state.values)
+            if key in values:
+                self.hits += 1
+                values.move_to_end(key)
+                hs.append(values[key])
+            else:
+                hs.append(None)
+                missing.append(i)
+        if missing:
+            self.misses += len(missing)
+            new = evaluate_batch(self.heuristic, [states[i] for i in missing])
+            for i, h in zip(missing, new):
+                hs[i] = values[(states[i].bits, states[i].values)] = h
+            while self.maxsize is not None and len(values) > self.maxsize:
+                values.popitem(last=False)
+        return hs
+
+    def __len__(self):
+        return len(self._values)
+
+    def clear(self):
+        self._values.clear()
 
 
 ########## HEURISTICS ##########
@@ -69,29 +682,294 @@ def null_heuristic(state):
     """Admissible, but trivial heuristic"""
     return 0
 
-def plan_cost(plan):
-    """Convert a plan to a cost, handling nonexistent plans"""
+def goal_count_heuristic(problem):
+    """
+    Counts the goals (including numerical ones) that do not hold. Not
+    admissible in general, but cheap, and vectorized over batches of
+    states with NumPy.
+    """
+    atoms = problem.atoms
+    goal_mask = problem.goal_mask
+    goal_columns = [atoms.index[g] for g in problem.goals]
+    num_goals = problem.num_goals
+
+    def h(state):
+        bits = _encode(atoms, state)
+        return (bin(goal_mask & ~bits).count('1') +
+                sum(1 for g in num_goals if not g(state)))
+
+    def batch(states):
+        if np is None:
+            return [h(state) for state in states]
+        true = atoms.matrix([_encode(atoms, state) for state in states])
+        missing = len(goal_columns) - true[:, goal_columns].sum(axis=1)
+        for g in num_goals:
+            missing += [not g(state) for state in states]
+        return missing.tolist()
+
+    h.batch = batch
+    return h
+
+def _encode(atoms, state):
+    """Returns the bitset of a state's predicates over the AtomTable"""
+    if state.atoms is atoms:
+        return state.bits
+    return atoms.mask(state.predicates)
+
+def plan_cost(plan, state=None):
+    """
+    Convert a plan to a cost, handling nonexistent plans. If action
+    costs depend on functions, the plan is executed from the given
+    state to evaluate them (a ValueError is raised if none is given).
+    """
     if plan is None:
-        return float('inf')
+        return INFINITY
+    elif state is None:
+        if any(isinstance(action.cost, tuple) for action in plan):
+            raise ValueError('A state is needed to evaluate action costs '
+                             'given by functions')
+        return sum(action.cost for action in plan)
     else:
-        return len(plan)
+        final = state
+        for action in plan:
+            final = final.apply(action)
+        return final.cost - state.cost
 
 def monotone_heuristic(problem):
     """Heuristic that finds plans using only add lists of actions"""
     def h(state):
         monotone_plan = planner(problem, null_heuristic, state, monotone=True, verbose=False)
-        return plan_cost(monotone_plan)
+        return plan_cost(monotone_plan, state)
     return h
 
-def subgoal_heuristic(problem):
-    """Heuristic that computes the max cost of plans across all subgoals"""
+def subgoal_heuristic(problem, workers=None):
+    """
+    Heuristic that computes the max cost of plans across all subgoals.
+    If workers is given, the subgoal searches are run in parallel by
+    a pool of that many processes (0 for one per CPU). The heuristic then
+    owns the pool, like a ParallelHeuristic: shut it down with close(),
+    or use the heuristic as a context manager.
+    """
+    if workers is not None:
+        return _ParallelSubgoalHeuristic(problem, workers)
+    subgoals = ([((g,), ()) for g in problem.goals] +
+                [((), (g,)) for g in problem.num_goals])
+
     def h(state):
         costs = []
-        for g in problem.goals:
-            subgoal_plan = planner(problem, null_heuristic, state, ((g,), ()))
-            costs.append(plan_cost(subgoal_plan))
-        for g in problem.num_goals:
-            subgoal_plan = planner(problem, null_heuristic, state, ((), (g,)))
-            costs.append(plan_cost(subgoal_plan))
+        for subgoal in subgoals:
+            subgoal_plan = planner(problem, null_heuristic, state, subgoal,
+                                   verbose=False)
+            costs.append(plan_cost(subgoal_plan, state))
         return max(costs)
     return h
+
+class ParallelHeuristic(object):
+
+    def __init__(self, problem, factory, workers=None):
+        """
+        Evaluates batches of states with a heuristic in a pool of worker
+        processes. The problem is sent to each worker once, when it starts,
+        and each worker builds its own heuristic as factory(problem), so the
+        factory must be picklable (e.g., hff_heuristic). Single states are
+        evaluated in this process. Use with batch_size > 1 in search.
+        @arg problem : a pyddl Problem
+        @arg factory : function returning a heuristic for the problem
+        @arg workers : number of processes (one per CPU by default)
+        """
+        self.heuristic = factory(problem)
+        self.workers = workers or _cpu_count()
+        self.pool = ProcessPoolExecutor(self.workers, initializer=_init_worker,
+                                        initargs=(problem, factory))
+
+    def __call__(self, state):
+        return self.heuristic(state)
+
+    def batch(self, states):
+        encoded = [(state.bits, state.values) for state in states]
+        size = -(-len(encoded) // self.workers)
+        chunks = [encoded[i:i + size] for i in range(0, len(encoded), size)]
+        hs = list()
+        for chunk in self.pool.map(_evaluate_chunk, chunks):
+            hs.extend(chunk)
+        return hs
+
+    def close(self):
+        """Shuts down the worker processes"""
+        self.pool.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+class _ParallelSubgoalHeuristic(ParallelHeuristic):
+    """subgoal_heuristic with its subgoal searches run in a process pool"""
+
+    def __init__(self, problem, workers):
+        self.workers = workers or _cpu_count()
+        self.n_subgoals = len(problem.goals) + len(problem.num_goals)
+        self.pool = ProcessPoolExecutor(self.workers, initializer=_init_worker,
+                                        initargs=(problem, None))
+
+    def __call__(self, state):
+        return max(self.pool.map(_subgoal_cost,
+                                 [(state.bits, state.values, i)
+                                  for i in range(self.n_subgoals)]))
+
+    def batch(self, states):
+        return [self(state) for state in states]
+
+def _cpu_count():
+    import multiprocessing
+    return multiprocessing.cpu_count()
+
+# Problem and heuristic of a worker process, set by _init_worker
+_worker = dict()
+
+def _init_worker(problem, factory):
+    _worker['problem'] = problem
+    if factory is not None:
+        _worker['heuristic'] = factory(problem)
+
+def _evaluate_chunk(encoded):
+    problem = _worker['problem']
+    h = _worker['heuristic']
+    return [h(problem.make_state(bits, values)) for bits, values in encoded]
+
+def _subgoal_cost(args):
+    bits, values, i = args
+    problem = _worker['problem']
+    subgoals = ([((g,), ()) for g in problem.goals] +
+                [((), (g,)) for g in problem.num_goals])
+    state = problem.make_state(bits, values)
+    subgoal_plan = planner(problem, null_heuristic, state, subgoals[i],
+                           verbose=False)
+    return plan_cost(subgoal_plan, state)
+
+def hmax_heuristic(problem):
+    """
+    Admissible delete-relaxation heuristic: the max over goals of
+    the cost of reaching each goal when delete lists are ignored
+    """
+    explore = _relaxed_exploration(problem)
+    def h(state):
+        goal_costs, _ = explore(state, max)
+        return max(goal_costs) if goal_costs else 0
+    return h
+
+def hadd_heuristic(problem):
+    """
+    Delete-relaxation heuristic that sums the relaxed costs of
+    reaching each goal (informative, but not admissible)
+    """
+    explore = _relaxed_exploration(problem)
+    def h(state):
+        goal_costs, _ = explore(state, _add)
+        return sum(goal_costs)
+    return h
+
+def hff_heuristic(problem):
+    """
+    FF heuristic: the cost of a relaxed plan extracted from the
+    best supporters found while computing the additive heuristic
+    """
+    explore = _relaxed_exploration(problem)
+    preconditions = explore.preconditions
+    def h(state):
+        goal_costs, supporters = explore(state, _add)
+        if INFINITY in goal_costs:
+            return INFINITY
+        relaxed_plan = set()
+        stack = list(explore.goals)
+        while stack:
+            p = stack.pop()
+            a = supporters.get(p)
+            if a is not None and a not in relaxed_plan:
+                relaxed_plan.add(a)
+                stack.extend(preconditions[a])
+        return sum(explore.cost(a, state) for a in relaxed_plan)
+    return h
+
+def _add(x, y):
+    return x + y
+
+def _relaxed_exploration(problem):
+    """
+    Precomputes the delete relaxation of the grounded problem and returns
+    a function explore(state, combine) that runs a generalized Dijkstra
+    search over atoms (numerical conditions are ignored). Precondition
+    costs are combined with `combine` (max or addition), and action costs
+    that depend on functions are evaluated in the given state. Returns the
+    costs of the goal atoms and a dictionary mapping each reached atom
+    to the index of its best supporting action.
+    """
+    atoms = problem.atoms
+    actions = problem.grounded_actions
+    preconditions = [tuple(set(atoms.intern(p) for p in a.preconditions))
+                     for a in actions]
+    add_effects = [tuple(set(atoms.intern(p) for p in a.add_effects))
+                   for a in actions]
+    goals = tuple(set(atoms.intern(g) for g in problem.goals))
+    required_by = dict()
+    for a, pres in enumerate(preconditions):
+        for p in pres:
+            required_by.setdefault(p, []).append(a)
+    n_pre = [len(pres) for pres in preconditions]
+    free_actions = [a for a, n in enumerate(n_pre) if n == 0]
+    infinity = INFINITY
+    constant_costs = [a.cost if not isinstance(a.cost, tuple) else None
+                      for a in actions]
+
+    def cost(a, state):
+        c = constant_costs[a]
+        if c is None:
+            return actions[a].step_cost(state)
+        return c
+
+    def explore(state, combine):
+        bits = _encode(atoms, state)
+        heap = list()
+        while bits:
+            low = bits & -bits
+            heap.append((0, low.bit_length() - 1))
+            bits ^= low
+        best = dict((p, 0) for _, p in heap)
+        supporters = dict()
+        remaining = list(n_pre)
+        action_costs = [0]*len(actions)
+        unsettled = len(goals)
+        goal_set = set(goals)
+        settled = set()
+
+        def trigger(a):
+            c = action_costs[a] + cost(a, state)
+            for q in add_effects[a]:
+                if c < best.get(q, infinity):
+                    best[q] = c
+                    supporters[q] = a
+                    heapq.heappush(heap, (c, q))
+
+        for a in free_actions:
+            trigger(a)
+        while heap and unsettled:
+            c, p = heapq.heappop(heap)
+            if p in settled:
+                continue
+            settled.add(p)
+            if p in goal_set:
+                unsettled -= 1
+            for a in required_by.get(p, ()):
+                action_costs[a] = combine(action_costs[a], c)
+                remaining[a] -= 1
+                if remaining[a] == 0:
+                    trigger(a)
+
+        goal_costs = [best[g] if g in settled else infinity for g in goals]
+        return goal_costs, supporters
+
+    explore.cost = cost
+    explore.preconditions = preconditions
+    explore.goals = goals
+    return explore
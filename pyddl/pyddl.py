@@ -2,16 +2,19 @@
 Classes and functions that allow creating a PDDL-like
 problem and domain definition for planning
 """
-from itertools import product
-import operator as ops
+from time import time
+from random import Random
+import hashlib
+import mmap
+import os
+import pickle
 
-NUM_OPS = {
-    '>' : ops.gt,
-    '<' : ops.lt,
-    '=' : ops.eq,
-    '>=': ops.ge,
-    '<=': ops.le
-}
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from .numeric import NUM_OPS, NumericCondition, NumericEffect, NumericTable
 
 class Domain(object):
 
@@ -22,37 +25,166 @@ class Domain(object):
         """
         self.actions = tuple(actions)
 
-    def ground(self, objects):
+    def ground(self, objects, init=None):
         """
         Ground all action schemas given a dictionary
-        of objects keyed by type
+        of objects keyed by type. If initial state predicates
+        are given, only actions that are reachable from them
+        (ignoring delete lists and numeric preconditions)
+        are grounded.
+        """
+        if init is None:
+            return [action.ground(*params)
+                    for action in self.actions
+                    for params in _bindings(action, objects)]
+
+        init = set(p for p in init if p[0] != '=')
+        static = self.static_predicates()
+        candidates = [action.ground(*params)
+                      for action in self.actions
+                      for params in _bindings(action, objects, static, init)]
+        return _reachable(candidates, init)
+
+    def static_predicates(self):
         """
-        grounded_actions = list()
+        Returns the names of predicates appearing in preconditions
+        that are never added or deleted by any action
+        """
+        used = set()
+        changed = set()
         for action in self.actions:
-            param_lists = [objects[t] for t in action.types]
-            param_combos = set()
-            for params in product(*param_lists):
-                param_set = frozenset(params)
-                if action.unique and len(param_set) != len(params):
-                    continue
-                if action.no_permute and param_set in param_combos:
-                    continue
-                param_combos.add(param_set)
-                grounded_actions.append(action.ground(*params))
-        return grounded_actions
+            for pre in action.preconditions:
+                if pre[0] not in NUM_OPS:
+                    used.add(pre[0])
+            for effect in action.effects:
+                if effect[0] == -1:
+                    changed.add(effect[1][0])
+                elif effect[0] not in ('+=', '-='):
+                    changed.add(effect[0])
+        return used - changed
+
+def _bindings(action, objects, static=(), init=()):
+    """
+    Yields parameter tuples for grounding the action, in the order
+    they appear in the product of the typed object lists. Preconditions
+    on static predicates are checked against the initial state as soon
+    as all of their parameters are bound, pruning the enumeration.
+    """
+    n = len(action.types)
+    param_lists = [objects[t] for t in action.types]
+    position = dict((name, i) for i, name in enumerate(action.arg_names))
+
+    # Static preconditions indexed by the number of parameters that
+    # must be bound before they can be checked
+    checks = [list() for _ in range(n + 1)]
+    for pre in action.preconditions:
+        if pre[0] in static:
+            bound = [position[arg] + 1 for arg in pre[1:] if arg in position]
+            checks[max(bound + [0])].append(pre)
+    if any(pre not in init for pre in checks[0]):
+        return
+
+    if n == 0:
+        yield ()
+        return
+
+    binding = dict()
+    params = [None]*n
+    param_combos = set()
+    choices = [iter(param_lists[0])]
+    while choices:
+        i = len(choices) - 1
+        for obj in choices[i]:
+            if action.unique and obj in params[:i]:
+                continue
+            params[i] = obj
+            binding[action.arg_names[i]] = obj
+            if all(pre[0:1] + tuple(binding.get(arg, arg) for arg in pre[1:])
+                   in init for pre in checks[i + 1]):
+                break
+        else:
+            choices.pop()
+            continue
+
+        if i + 1 < n:
+            choices.append(iter(param_lists[i + 1]))
+            continue
+
+        param_set = frozenset(params)
+        if action.no_permute and param_set in param_combos:
+            continue
+        param_combos.add(param_set)
+        yield tuple(params)
+
+def _reachable(actions, init):
+    """
+    Filters grounded actions to those whose preconditions are reachable
+    from the initial predicates when delete lists are ignored
+    """
+    reached = set(init)
+    waiting = dict()
+    missing = list()
+    queue = list(reached)
+    fired = [False]*len(actions)
+
+    def fire(i):
+        fired[i] = True
+        for effect in actions[i].add_effects:
+            if effect not in reached:
+                reached.add(effect)
+                queue.append(effect)
+
+    for i, action in enumerate(actions):
+        pre = set(action.preconditions)
+        missing.append(len(pre))
+        for p in pre:
+            waiting.setdefault(p, []).append(i)
+        if not pre:
+            fire(i)
+
+    while queue:
+        p = queue.pop()
+        for i in waiting.pop(p, ()):
+            missing[i] -= 1
+            if missing[i] == 0:
+                fire(i)
+
+    return [action for i, action in enumerate(actions) if fired[i]]
 
 class Problem(object):
 
-    def __init__(self, domain, objects, init=(), goal=()):
+    def __init__(self, domain, objects, init=(), goal=(), prune=False,
+                 cache=None):
         """
         Represents a PDDL Problem Specification
-        @arg domain : Domain object specifying domain
+        @arg domain : Domain object specifying domain, or a GroundedDomain
+                      (objects, prune and cache are then ignored)
         @arg objects : dictionary of object tuples keyed by type
         @arg init : tuple of initial state predicates
         @arg goal : tuple of goal state predicates
+        @arg prune : if True, only ground actions that are reachable
+                     from the initial state (plans searched from
+                     other initial states may then be missed)
+        @arg cache : if not None, a GroundingCache from which the
+                     grounded domain is loaded (grounding and saving
+                     it there if it is missing)
         """
         # Ground actions from domain
-        self.grounded_actions = domain.ground(objects)
+        start = time()
+        reachable_from = init if prune else None
+        if isinstance(domain, GroundedDomain):
+            grounded = domain
+        elif cache is not None:
+            grounded = cache.ground(domain, objects, reachable_from)
+        else:
+            grounded = GroundedDomain(domain, objects, reachable_from)
+        self.grounding_time = time() - start
+        self.grounded_actions = grounded.grounded_actions
+        self.action_index = grounded.action_index
+        self.atoms = grounded.atoms
+        self.fluents = grounded.fluents
+        self.numeric_table = grounded.numeric_table
+        self.successor_generator = grounded.successor_generator
 
         # Parse Initial State
         predicates = list()
@@ -62,30 +194,388 @@ class Problem(object):
                 functions[predicate[1]] = predicate[2]
             else:
                 predicates.append(predicate)
-        self.initial_state = State(predicates, functions)
 
         # Parse Goal State
         self.goals = list()
         self.num_goals = list()
         for g in goal:
             if g[0] in NUM_OPS:
-                ng = _num_pred(NUM_OPS[g[0]], *g[1:])
+                ng = NumericCondition(*g)
+                ng.compiled(self.fluents)
                 self.num_goals.append(ng)
             else:
                 self.goals.append(g)
+        self.goal_mask = self.atoms.mask(self.goals)
+
+        # All function symbols are interned before creating states
+        for f in functions:
+            self.fluents.intern(f)
+        self.initial_state = State(predicates, functions, atoms=self.atoms,
+                                   fluents=self.fluents)
+
+    def make_state(self, bits, values, cost=0, predecessor=None):
+        """
+        Returns a state given its encoding as a bitset of predicates and
+        a tuple of function values over this problem's tables
+        """
+        return _make_state(self.atoms, self.fluents, bits, values, cost,
+                           predecessor)
+
+    def applicable_actions(self, state):
+        """Returns the grounded actions applicable in the given state"""
+        return self.successor_generator.applicable(state)
+
+class GroundedDomain(object):
+
+    def __init__(self, domain, objects, init=None):
+        """
+        The actions of a domain grounded with a set of objects, compiled
+        to bit masks over interned atoms and slots of function symbols
+        @arg domain : Domain object specifying domain
+        @arg objects : dictionary of object tuples keyed by type
+        @arg init : if not None, only actions reachable from these initial
+                    state predicates are grounded (see Domain.ground)
+        """
+        self.grounded_actions = domain.ground(objects, init)
+        # Position of each grounded action, by which searches store actions
+        self.action_index = dict((a, i) for i, a in
+                                 enumerate(self.grounded_actions))
+
+        # Intern ground atoms and function symbols, and compile
+        # actions to bit masks and numeric slots
+        self.atoms = AtomTable()
+        self.fluents = AtomTable()
+        for action in self.grounded_actions:
+            action.masks(self.atoms)
+            action.numeric_effects(self.fluents)
+            if isinstance(action.cost, tuple):
+                self.fluents.intern(action.cost)
+        self.numeric_table = NumericTable(self.grounded_actions, self.fluents)
+        self.successor_generator = SuccessorGenerator(self.grounded_actions,
+                                                      self.atoms,
+                                                      self.numeric_table)
+
+    def problem(self, init=(), goal=()):
+        """
+        Returns a Problem with the given initial state and goal predicates
+        over this grounded domain, without grounding it again. Problems
+        created this way share the tables of interned atoms.
+        """
+        return Problem(self, None, init, goal)
+
+    def save(self, path):
+        """Writes the grounded domain to a file"""
+        with open(path, 'wb') as f:
+            pickle.dump(self, f, pickle.HIGHEST_PROTOCOL)
+
+    @staticmethod
+    def load(path):
+        """
+        Reads a grounded domain written with save, unpickling it
+        directly from the memory-mapped file
+        """
+        with open(path, 'rb') as f:
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                return pickle.loads(data)
+            finally:
+                data.close()
+
+# Version of the grounded domain file format, which is part of the
+# cache keys so that files written by older versions are not loaded
+GROUNDING_CACHE_VERSION = 2
+
+class GroundingCache(object):
+
+    def __init__(self, directory):
+        """
+        Saves grounded domains to files in a directory, keyed by a hash of
+        the domain and objects, so that problems sharing a domain and set
+        of objects load them instead of grounding the domain again. Loaded
+        domains are also kept in memory.
+        @arg directory : directory for the cache files (created if needed)
+        """
+        self.directory = directory
+        self.loaded = dict()
+        self.hits = 0
+        self.misses = 0
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def key(self, domain, objects, init=None):
+        """
+        Returns the hexadecimal key of a domain grounded with the given
+        objects (and initial predicates, if actions are pruned with them)
+        """
+        actions = [(a.name, a.types, a.arg_names, a.preconditions, a.effects,
+                    a.unique, a.no_permute, a.cost) for a in domain.actions]
+        objects = sorted((t, tuple(objs)) for t, objs in objects.items())
+        if init is not None:
+            init = sorted(repr(p) for p in init if p[0] != '=')
+        text = repr((GROUNDING_CACHE_VERSION, actions, objects, init))
+        return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.directory, key + '.pyddl')
+
+    def ground(self, domain, objects, init=None):
+        """
+        Returns the GroundedDomain for the given arguments (see
+        GroundedDomain), loading or grounding and saving it as needed
+        """
+        key = self.key(domain, objects, init)
+        grounded = self.loaded.get(key)
+        if grounded is not None:
+            self.hits += 1
+            return grounded
+        path = self.path(key)
+        if os.path.exists(path):
+            self.hits += 1
+            grounded = GroundedDomain.load(path)
+        else:
+            self.misses += 1
+            grounded = GroundedDomain(domain, objects, init)
+            # Write to a temporary file first, so that concurrent
+            # processes never load a partially written file
+            tmp = '%s.%d.tmp' % (path, os.getpid())
+            grounded.save(tmp)
+            os.rename(tmp, path)
+        self.loaded[key] = grounded
+        return grounded
+
+# Seed for the Zobrist keys of interned atoms
+ZOBRIST_SEED = 0x5eed
+
+class AtomTable(object):
+
+    def __init__(self, atoms=()):
+        """
+        Interns ground atoms to consecutive integer indices, so that sets
+        of atoms can be represented as bitsets (Python ints). Each atom
+        also gets a random 64-bit key for Zobrist hashing, drawn from a
+        fixed seed so that equal tables produce equal hashes.
+        @arg atoms : atoms to intern initially
+        """
+        self.atoms = list()
+        self.index = dict()
+        self.keys = list()
+        self._random = Random(ZOBRIST_SEED)
+        for atom in atoms:
+            self.intern(atom)
+
+    def intern(self, atom):
+        """Returns the index of the atom, adding it if necessary"""
+        i = self.index.get(atom)
+        if i is None:
+            i = self.index[atom] = len(self.atoms)
+            self.atoms.append(atom)
+            self.keys.append(self._random.getrandbits(64))
+        return i
+
+    def zobrist(self, bits):
+        """Returns the Zobrist hash (XOR of atom keys) of a bitset"""
+        keys = self.keys
+        h = 0
+        while bits:
+            low = bits & -bits
+            h ^= keys[low.bit_length() - 1]
+            bits ^= low
+        return h
+
+    def mask(self, atoms):
+        """Returns the bitset for a collection of atoms"""
+        bits = 0
+        for atom in atoms:
+            bits |= 1 << self.intern(atom)
+        return bits
+
+    def decode(self, bits):
+        """Returns the frozenset of atoms in a bitset"""
+        atoms = list()
+        while bits:
+            low = bits & -bits
+            atoms.append(self.atoms[low.bit_length() - 1])
+            bits ^= low
+        return frozenset(atoms)
+
+    def matrix(self, bitsets, width=None):
+        """
+        Returns a boolean NumPy array with a row for each bitset and a
+        column for each of the first `width` atoms (all by default)
+        """
+        if width is None:
+            width = len(self.atoms)
+        n_bytes = (width + 7) // 8
+        limit = (1 << width) - 1
+        data = b''.join((bits & limit).to_bytes(n_bytes, 'little')
+                        for bits in bitsets)
+        rows = np.frombuffer(data, dtype=np.uint8).reshape(len(bitsets),
+                                                            n_bytes)
+        return np.unpackbits(rows, axis=1,
+                             bitorder='little')[:, :width].astype(bool)
+
+    def __len__(self):
+        return len(self.atoms)
+
+# Tables for states constructed outside of a Problem
+_default_atoms = AtomTable()
+_default_fluents = AtomTable()
+
+class SuccessorGenerator(object):
+
+    def __init__(self, actions, atoms, numeric_table):
+        """
+        Indexes grounded actions by their preconditions in a trie, so that
+        the actions applicable in a state can be found without testing
+        every action. Preconditions are sorted so that atoms shared by
+        many actions appear near the root, where their tests are shared.
+        Numerical preconditions of the candidate actions are then checked
+        together using the NumericTable.
+        @arg actions : list of grounded actions
+        @arg atoms : AtomTable used to encode states
+        @arg numeric_table : NumericTable compiled for the actions
+        """
+        self.atoms = atoms
+        self.numeric_table = numeric_table
+        self.actions = list(actions)
+        self._pre_index = None
+        frequency = dict()
+        for action in actions:
+            for pre in set(atoms.intern(p) for p in action.preconditions):
+                frequency[pre] = frequency.get(pre, 0) + 1
+        order = dict((pre, i) for i, pre in
+                     enumerate(sorted(frequency, key=frequency.get, reverse=True)))
+
+        self.root = _GeneratorNode()
+        for action in actions:
+            node = self.root
+            pres = set(atoms.intern(p) for p in action.preconditions)
+            for pre in sorted(pres, key=order.get):
+                child = node.children.get(pre)
+                if child is None:
+                    child = node.children[pre] = _GeneratorNode()
+                node = child
+            node.actions.append(action)
+
+    def applicable(self, state):
+        """
+        Returns a list of the actions whose preconditions
+        (including numerical ones) hold in the given state
+        """
+        if state.atoms is self.atoms:
+            bits = state.bits
+        else:
+            bits = self.atoms.mask(state.predicates)
+        candidates = list()
+        stack = [self.root]
+        while stack:
+            node = stack.pop()
+            candidates.extend(node.actions)
+            stack.extend(child for pre, child in node.children.items()
+                         if bits >> pre & 1)
+        if state.fluents is not self.numeric_table.fluents:
+            return [a for a in candidates
+                    if all(np(state) for np in a.num_preconditions)]
+        return self.numeric_table.filter(state, candidates)
+
+    def applicable_batch(self, states):
+        """
+        Returns a list with the applicable actions of each given state.
+        With NumPy, all preconditions of all actions are checked for the
+        batch of states at once using array operations.
+        """
+        if np is None or any(s.atoms is not self.atoms or
+                             s.fluents is not self.numeric_table.fluents
+                             for s in states):
+            return [self.applicable(s) for s in states]
+
+        n_atoms = len(self.atoms)
+        if self._pre_index is None or self._pre_index[0] != n_atoms:
+            # Precondition indices padded with a column that always holds
+            pres = [sorted(set(self.atoms.intern(p) for p in a.preconditions))
+                    for a in self.actions]
+            width = max([len(p) for p in pres] + [1])
+            index = np.array([p + [n_atoms]*(width - len(p)) for p in pres],
+                             dtype=int).reshape(len(pres), width)
+            self._pre_index = (n_atoms, index)
+        true = self.atoms.matrix([s.bits for s in states], n_atoms)
+        true = np.hstack([true, np.ones((len(states), 1), dtype=bool)])
+        ok = true[:, self._pre_index[1]].all(axis=2)
+        ok &= ~self.numeric_table.failed([s.values for s in states])
+        actions = self.actions
+        return [[actions[i] for i in np.flatnonzero(row)] for row in ok]
+
+class _GeneratorNode(object):
+    """
+    A node in the successor generator trie holding the actions whose
+    preconditions are exactly the atoms (indices) on the path to the node
+    """
+    def __init__(self):
+        self.actions = list()
+        self.children = dict()
 
 class State(object):
+    __slots__ = ('atoms', 'bits', 'fluents', 'values', 'predecessor', 'cost',
+                 'key', '_hash')
 
-    def __init__(self, predicates, functions, cost=0, predecessor=None):
-        """Represents a state for A* search"""
-        self.predicates = frozenset(predicates)
-        self.functions = tuple(functions.items())
-        self.f_dict = functions
+    def __init__(self, predicates, functions, cost=0, predecessor=None,
+                 atoms=None, fluents=None):
+        """
+        Represents a state for A* search. Predicates are stored as a
+        bitset over the atoms interned in an AtomTable, and function
+        values as a tuple indexed by the function symbols interned in
+        another (by default, tables shared by all states constructed
+        outside of a Problem). Undefined functions have value None.
+        The Zobrist hash of the predicates (key) is updated incrementally
+        when actions are applied, and the state's hash is cached. As the
+        hash depends on the tables, states over different tables are never
+        equal; to compare them, rebuild one over the other's tables with
+        State(s.predicates, s.f_dict, atoms=..., fluents=...).
+        """
+        if atoms is None:
+            atoms = _default_atoms
+        if fluents is None:
+            fluents = _default_fluents
+        self.atoms = atoms
+        self.bits = atoms.mask(predicates)
+        self.fluents = fluents
+        slots = [fluents.intern(f) for f in functions]
+        values = [None]*len(fluents)
+        for slot, value in zip(slots, functions.values()):
+            values[slot] = value
+        self.values = tuple(values)
         self.predecessor = predecessor
         self.cost = cost
+        self.key = atoms.zobrist(self.bits)
+        self._hash = self.key ^ hash(self.values)
+
+    @property
+    def predicates(self):
+        return self.atoms.decode(self.bits)
+
+    @property
+    def f_dict(self):
+        """Dictionary of function values keyed by function symbol"""
+        return dict((f, v) for f, v in zip(self.fluents.atoms, self.values)
+                    if v is not None)
+
+    @property
+    def functions(self):
+        return tuple(self.f_dict.items())
+
+    def value(self, function):
+        """Returns the value of a function symbol"""
+        return self.values[self.fluents.index[function]]
 
     def is_true(self, predicates, num_predicates):
-        return (all(p in self.predicates for p in predicates) and
+        return self.holds(self.atoms.mask(predicates), num_predicates)
+
+    def holds(self, mask, num_predicates):
+        """
+        Like is_true, but with the predicates given as a bitset
+        over this state's AtomTable
+        """
+        return (self.bits & mask == mask and
                 all(np(self) for np in num_predicates))
 
     def apply(self, action, monotone=False):
@@ -93,15 +583,26 @@ class State(object):
         Apply the action to this state to produce a new state.
         If monotone, ignore the delete list (for A* heuristic)
         """
-        new_preds = set(self.predicates)
-        new_preds |= set(action.add_effects)
+        _, add, delete = action.masks(self.atoms)
+        bits = self.bits | add
         if not monotone:
-            new_preds -= set(action.del_effects)
-        new_functions = dict()
-        new_functions.update(self.functions)
-        for function, value in action.num_effects:
-            new_functions[function] += value(self)
-        return State(new_preds, new_functions, self.cost + 1, (self, action))
+            bits &= ~delete
+        key = self.key
+        if bits != self.bits:
+            key ^= action.zobrist_delta(self.atoms, bits ^ self.bits)
+        values = self.values
+        if action.num_effects:
+            new_values = list(values)
+            for slot, sign, vs, vc in action.numeric_effects(self.fluents):
+                new_values[slot] += sign*(vc if vs is None else values[vs])
+            values = tuple(new_values)
+            h = key ^ hash(values)
+        else:
+            h = self._hash ^ self.key ^ key
+
+        return _make_state(self.atoms, self.fluents, bits, values,
+                           self.cost + action.step_cost(self), (self, action),
+                           key, h)
 
     def plan(self):
         """
@@ -120,17 +621,40 @@ class State(object):
     # check if we've encountered this state before
 
     def __hash__(self):
-        return hash((self.predicates, self.functions))
+        return self._hash
 
     def __eq__(self, other):
-        return ((self.predicates, self.functions) ==
-                (other.predicates, other.functions))
+        # Hashes are only consistent between states over the same tables
+        return (self.atoms is other.atoms and self.fluents is other.fluents
+                and self.bits == other.bits and self.values == other.values)
+
+    def __ne__(self, other):
+        return not self == other
 
     def __str__(self):
         return ('Predicates:\n%s' % '\n'.join(map(str, self.predicates))
                 +'\nFunctions:\n%s' % '\n'.join(map(str, self.functions)))
     def __lt__(self, other):
-        return hash(self) < hash(other)
+        return self._hash < other._hash
+
+def _make_state(atoms, fluents, bits, values, cost, predecessor,
+                key=None, h=None):
+    """
+    Constructs a State directly from its encoding, given its Zobrist
+    key and hash if they are known
+    """
+    state = State.__new__(State)
+    state.atoms = atoms
+    state.bits = bits
+    state.fluents = fluents
+    state.values = values
+    state.predecessor = predecessor
+    state.cost = cost
+    if key is None:
+        key = atoms.zobrist(bits)
+    state.key = key
+    state._hash = key ^ hash(values) if h is None else h
+    return state
 
 def neg(effect):
     """
@@ -143,7 +667,7 @@ class Action(object):
     An action schema
     """
     def __init__(self, name, parameters=(), preconditions=(), effects=(),
-                 unique=False, no_permute=False):
+                 unique=False, no_permute=False, cost=1):
         """
         A PDDL-like action schema
         @arg name : action name for display purposes
@@ -154,6 +678,9 @@ class Action(object):
         @arg unique : if True, only ground with unique arguments (no duplicates)
         @arg no_permute : if True, do not ground an action twice with the same
                           set of (permuted) arguments
+        @arg cost : nonnegative cost of applying the action, either a number
+                    or a function symbol (like the values of '+=' effects)
+                    evaluated in the state where the action is applied
         """
         self.name = name
         if len(parameters) > 0:
@@ -165,6 +692,7 @@ class Action(object):
         self.effects = effects
         self.unique = unique
         self.no_permute = no_permute
+        self.cost = cost
 
     def ground(self, *args):
         return _GroundedAction(self, *args)
@@ -184,35 +712,6 @@ def _grounder(arg_names, args):
         return predicate[0:1] + tuple(namemap.get(arg, arg) for arg in predicate[1:])
     return _ground_by_names
 
-def _num_pred(op, x, y):
-    """
-    Returns a numerical predicate that is called on a State.
-    """
-    def predicate(state):
-        operands = [0, 0]
-        for i, o in enumerate((x, y)):
-            if type(o) == int:
-                operands[i] = o
-            else:
-                operands[i] = state.f_dict[o]
-        return op(*operands)
-    return predicate
-
-def _num_effect(ground, sign, x):
-    """
-    Returns a numerical effect that is called on a State.
-    """
-    if type(x) != int:
-        x = ground(x)
-
-    def effect(state):
-        if type(x) == int:
-            return sign*x
-        else:
-            return sign*state.f_dict[x]
-
-    return effect
-
 class _GroundedAction(object):
     """
     An action schema that has been grounded with objects
@@ -229,17 +728,19 @@ class _GroundedAction(object):
         self.num_preconditions = list()
         for pre in action.preconditions:
             if pre[0] in NUM_OPS:
-                operands = [0, 0]
-                for i in range(2):
-                    if type(pre[i + 1]) == int:
-                        operands[i] = pre[i + 1]
-                    else:
-                        operands[i] = ground(pre[i + 1])
-                np = _num_pred(NUM_OPS[pre[0]], *operands)
+                operands = [ground(o) if isinstance(o, tuple) else o
+                            for o in pre[1:3]]
+                np = NumericCondition(pre[0], *operands)
                 self.num_preconditions.append(np)
             else:
                 self.preconditions.append(ground(pre))
 
+        # Ground Cost
+        if isinstance(action.cost, tuple):
+            self.cost = ground(action.cost)
+        else:
+            self.cost = action.cost
+
         # Ground Effects
         self.add_effects = list()
         self.del_effects = list()
@@ -247,17 +748,65 @@ class _GroundedAction(object):
         for effect in action.effects:
             if effect[0] == -1:
                 self.del_effects.append(ground(effect[1]))
-            elif effect[0] == '+=':
-                function = ground(effect[1])
-                value = _num_effect(ground, 1, effect[2])
-                self.num_effects.append((function, value))
-            elif effect[0] == '-=':
+            elif effect[0] in ('+=', '-='):
                 function = ground(effect[1])
-                value = _num_effect(ground, -1, effect[2])
-                self.num_effects.append((function, value))
+                value = effect[2]
+                if isinstance(value, tuple):
+                    value = ground(value)
+                sign = 1 if effect[0] == '+=' else -1
+                self.num_effects.append(NumericEffect(function, sign, value))
             else:
                 self.add_effects.append(ground(effect))
 
+        self._atoms = None
+        self._masks = None
+        self._fluents = None
+        self._numeric_effects = None
+        self._zobrist = None
+
+    def step_cost(self, state):
+        """Returns the cost of applying this action in the given state"""
+        if isinstance(self.cost, tuple):
+            return state.value(self.cost)
+        return self.cost
+
+    def masks(self, atoms):
+        """
+        Returns the (precondition, add, delete) bitsets of this action
+        over the given AtomTable, caching them for the last table used
+        """
+        if self._atoms is not atoms:
+            self._masks = (atoms.mask(self.preconditions),
+                           atoms.mask(self.add_effects),
+                           atoms.mask(self.del_effects))
+            self._atoms = atoms
+        return self._masks
+
+    def numeric_effects(self, fluents):
+        """
+        Returns the numeric effects of this action compiled to
+        (target slot, sign, value slot, value constant) tuples over
+        the given table of function symbols, caching them
+        """
+        if self._fluents is not fluents:
+            self._numeric_effects = [e.compiled(fluents)
+                                     for e in self.num_effects]
+            self._fluents = fluents
+        return self._numeric_effects
+
+    def zobrist_delta(self, atoms, changed):
+        """
+        Returns the Zobrist hash of a bitset of atoms changed by applying
+        this action, caching the last one (which is usually the same for
+        every state the action is applied in)
+        """
+        cached = self._zobrist
+        if cached is not None and cached[0] is atoms and cached[1] == changed:
+            return cached[2]
+        key = atoms.zobrist(changed)
+        self._zobrist = (atoms, changed, key)
+        return key
+
     def __str__(self):
         arglist = ', '.join(map(str, self.sig[1:]))
         return '%s(%s)' % (self.sig[0], arglist)
@@ -4,6 +4,8 @@ try:
     # arguments that distutils doesn't understand
     setuptools_kwargs = {
         'provides': ['pyddl'],
+        'extras_require': {'numpy': ['numpy']},
+        'python_requires': '>=3.5',
     }
 except ImportError:
     from distutils.core import setup
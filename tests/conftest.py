@@ -0,0 +1,8 @@
+"""
+The tests import pyddl and the example scripts from the repository root
+"""
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
@@ -0,0 +1,59 @@
+"""
+Every search engine finds plans as cheap as A* on the bundled examples
+"""
+import pytest
+
+from benchmark import example
+from pyddl import (search, anytime_planner, plan_cost, ida_search,
+                   sma_search, external_search, hda_search, portfolio_search,
+                   pdb_heuristic)
+
+EXAMPLES = [
+    ('eight_puzzle_example',),
+    ('gripper_example',),
+    ('missionaries_cannibals_example',),
+    ('numeric_effects',),
+    ('hanoi_tower_example', 3),
+]
+
+# Engines taking a heuristic for the problem; the example's own heuristic
+# is used when it has one
+ENGINES = [
+    ('ida', lambda p, h: ida_search(p, h)),
+    ('sma', lambda p, h: sma_search(p, h, max_nodes=5000)),
+    ('external', lambda p, h: external_search(p, h)),
+]
+
+# Engines running in other processes build the heuristic from the problem,
+# so they are given an admissible factory instead
+PARALLEL_ENGINES = [
+    ('hda', lambda p: hda_search(p, pdb_heuristic, workers=2)),
+    ('portfolio', lambda p: portfolio_search(
+        p, [dict(heuristic=pdb_heuristic),
+            dict(heuristic=pdb_heuristic, weight=2)], first=False)[0]),
+]
+
+@pytest.fixture(scope='module', params=EXAMPLES, ids=lambda e: e[0])
+def solved(request):
+    problem, heuristic = example(*request.param)
+    return problem, heuristic, search(problem, heuristic).cost
+
+@pytest.mark.parametrize('engine', ENGINES, ids=lambda e: e[0])
+def test_engine_cost(solved, engine):
+    problem, heuristic, cost = solved
+    result = engine[1](problem, heuristic)
+    assert result.plan is not None
+    assert result.cost == cost
+
+@pytest.mark.parametrize('engine', PARALLEL_ENGINES, ids=lambda e: e[0])
+def test_parallel_engine_cost(solved, engine):
+    problem, _, cost = solved
+    result = engine[1](problem)
+    assert result.plan is not None
+    assert result.cost == cost
+
+def test_anytime_cost(solved):
+    problem, heuristic, cost = solved
+    plans = list(anytime_planner(problem, heuristic))
+    assert plans
+    assert plan_cost(plans[-1], problem.initial_state) == cost
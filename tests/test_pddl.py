@@ -0,0 +1,80 @@
+"""
+Parsing a typed PDDL domain and problem with action costs, and solving it
+"""
+import io
+
+from pyddl import parse, parse_domain, search
+
+DOMAIN = """
+; Delivering a package by truck; driving costs the length of the road
+(define (domain delivery)
+  (:requirements :strips :typing :action-costs)
+  (:types truck - vehicle
+          vehicle package location - object)
+  (:predicates (at ?x - object ?l - location)
+               (in ?p - package ?v - vehicle)
+               (road ?from ?to - location))
+  (:functions (road-length ?from ?to - location) (total-cost))
+  (:action load
+    :parameters (?p - package ?v - vehicle ?l - location)
+    :precondition (and (at ?p ?l) (at ?v ?l))
+    :effect (and (not (at ?p ?l)) (in ?p ?v)
+                 (increase (total-cost) 1)))
+  (:action unload
+    :parameters (?p - package ?v - vehicle ?l - location)
+    :precondition (and (in ?p ?v) (at ?v ?l))
+    :effect (and (not (in ?p ?v)) (at ?p ?l)
+                 (increase (total-cost) 1)))
+  (:action drive
+    :parameters (?v - truck ?from ?to - location)
+    :precondition (and (at ?v ?from) (road ?from ?to))
+    :effect (and (not (at ?v ?from)) (at ?v ?to)
+                 (increase (total-cost) (road-length ?from ?to)))))
+"""
+
+PROBLEM = """
+(define (problem deliver-one)
+  (:domain delivery)
+  (:objects t1 - truck
+            p1 - package
+            a b c d - location)
+  (:init (at t1 a) (at p1 a)
+         (road a d) (road a b) (road b c) (road c d)
+         (= (road-length a d) 10)
+         (= (road-length a b) 2)
+         (= (road-length b c) 2)
+         (= (road-length c d) 2)
+         (= (total-cost) 0))
+  (:goal (at p1 d))
+  (:metric minimize (total-cost)))
+"""
+
+def test_parse_types():
+    domain = parse_domain(io.StringIO(DOMAIN))
+    assert domain.types['truck'] == 'vehicle'
+    assert domain.types['location'] == 'object'
+    problem = parse(io.StringIO(DOMAIN), io.StringIO(PROBLEM))
+    # Trucks can load packages as vehicles, but only trucks drive
+    assert set(a.name for a in problem.grounded_actions) == set(
+        ['load', 'unload', 'drive'])
+
+def test_solve_with_action_costs():
+    problem = parse(io.StringIO(DOMAIN), io.StringIO(PROBLEM))
+    result = search(problem)
+    # The long way round is cheaper than the direct road
+    assert result.cost == 8
+    assert [a.sig for a in result.plan] == [
+        ('load', 'p1', 't1', 'a'),
+        ('drive', 't1', 'a', 'b'),
+        ('drive', 't1', 'b', 'c'),
+        ('drive', 't1', 'c', 'd'),
+        ('unload', 'p1', 't1', 'd'),
+    ]
+
+def test_parse_files(tmp_path):
+    domain_file = tmp_path / 'domain.pddl'
+    problem_file = tmp_path / 'problem.pddl'
+    domain_file.write_text(DOMAIN)
+    problem_file.write_text(PROBLEM)
+    problem = parse(str(domain_file), str(problem_file), prune=True)
+    assert search(problem).cost == 8